@@ -6,13 +6,18 @@ from flask_login import LoginManager
 from flask_mail import Mail
 from flask_moment import Moment
 from flask_pagedown import PageDown
-from flask_sqlalchemy import SQLAlchemy
+
+from .cache import response_cache
+from .follow_cache import follow_cache
+from .fragments import fragment_cache
+from .instrumentation import query_instrumentation
+from .replicas import RoutingSQLAlchemy
 
 
 bootstrap = Bootstrap()
 mail = Mail()
 moment = Moment()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 login_manager = LoginManager()
 login_manager.login_view = "auth.login"
 pagedown = PageDown()
@@ -37,6 +42,10 @@ def create_app(config_name: str) -> Flask:
     db.init_app(app)
     login_manager.init_app(app)
     pagedown.init_app(app)
+    response_cache.init_app(app)
+    follow_cache.init_app(app)
+    fragment_cache.init_app(app)
+    query_instrumentation.init_app(app)
 
     # attach routes an custom error pages here
 
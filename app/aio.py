@@ -0,0 +1,71 @@
+"""An asyncio SQLAlchemy engine for the async API views.
+
+The ASGI application in app.api.aio serves the read-only ``/api/v1`` routes
+from coroutines that query through an ``AsyncSession`` on the database named
+by FLASKY_ASYNC_DATABASE_URI, by default the main database with its async
+driver: aiosqlite for SQLite, asyncpg for PostgreSQL. The engine's pool
+holds up to FLASKY_ASYNC_POOL_SIZE connections, all used from the server's
+event loop.
+"""
+from typing import Any, Optional
+
+from flask import current_app
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+
+def async_database_uri(uri: str) -> str:
+    """The URI of the database at `uri`, using the dialect's async driver.
+
+    Raises:
+        ValueError: If the database is an in-memory SQLite database, which a
+        second engine cannot share, or there is no known async driver.
+    """
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend == "sqlite" and url.database in (None, "", ":memory:"):
+        raise ValueError("An in-memory SQLite database has no async URI")
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for {backend}")
+
+    return str(url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}"))
+
+
+class AsyncDatabase:
+    """Flask extension holding each application's async engine."""
+
+    def __init__(self, app=None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        uri = app.config["FLASKY_ASYNC_DATABASE_URI"] or async_database_uri(
+            app.config["SQLALCHEMY_DATABASE_URI"]
+        )
+        # aiosqlite would otherwise open a new connection for every checkout
+        app.extensions["async_db"] = create_async_engine(
+            uri,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=app.config["FLASKY_ASYNC_POOL_SIZE"],
+        )
+
+    @property
+    def engine(self) -> Optional[Any]:
+        return current_app.extensions.get("async_db")
+
+    def session(self) -> Any:
+        """A new AsyncSession, to be used as an ``async with`` block."""
+        from sqlalchemy.ext.asyncio import AsyncSession
+
+        return AsyncSession(self.engine, expire_on_commit=False)
+
+
+async_db = AsyncDatabase()
@@ -3,4 +3,4 @@ from flask import Blueprint
 
 api = Blueprint("api", __name__)
 
-from . import authentication, posts, users, comments, errors  # noqa
+from . import authentication, posts, users, comments, export, search, errors  # noqa
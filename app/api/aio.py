@@ -0,0 +1,205 @@
+"""An ASGI application serving the api blueprint's read-only views.
+
+AsyncAPI runs the coroutines in ASYNC_VIEWS on the server's event loop,
+reading through app.aio's pooled AsyncSession, so a request waiting on the
+database holds no thread. Everything else is handed to the Flask app through
+asgiref's WsgiToAsgi, as are requests the coroutines cannot answer on their
+own: keyset (cursor) pages, and clients whose credentials are not yet in the
+credential cache. The sync path verifies those, and caches them for the
+requests that follow. URLs, ETags and JSON bodies are the same on both paths.
+"""
+from typing import Any, Callable, Dict, Optional
+
+from flask import abort, current_app, request
+from sqlalchemy import func, select
+from werkzeug.exceptions import HTTPException
+
+from .authentication import _password_key, get_credential_cache
+from .conditional import conditional_json, row_etag
+from .pagination import Page
+from .serializers import comments_to_json, posts_to_json
+from ..aio import async_db
+from ..models import Comment, Post, User
+
+
+async def get_or_404(session, model, id: int) -> Any:
+    row = await session.get(model, id)
+    if row is None:
+        abort(404)
+
+    return row
+
+
+async def paginate(session, model, per_page: int) -> Page:
+    """Offset-paginate every row of `model` newest first, like pagination.paginate."""
+    page = max(request.args.get("page", 1, type=int), 1)
+    result = await session.execute(
+        select(model)
+        .order_by(model.timestamp.desc(), model.id.desc())
+        .limit(per_page)
+        .offset((page - 1) * per_page)
+    )
+    items = result.scalars().all()
+    total = await session.scalar(select(func.count()).select_from(model))
+    prev_args = {"page": page - 1} if page > 1 else None
+    next_args = {"page": page + 1} if page * per_page < total else None
+    return Page(items, total, prev_args, next_args)
+
+
+async def authenticate(session) -> Optional[User]:
+    """The user whose credentials are in the credential cache, or None."""
+    authorization = request.authorization
+    if authorization is None or not authorization.username:
+        return None
+
+    if authorization.password:
+        key = _password_key(authorization.username.lower(), authorization.password)
+    else:
+        key = ("token", authorization.username)
+
+    entry = get_credential_cache().get(key) if key is not None else None
+    if entry is None:
+        return None
+
+    user_id, fingerprint = entry
+    user = await session.get(User, user_id)
+    if user is None or user.credentials_fingerprint() != fingerprint:
+        return None
+
+    return user if user.confirmed else None
+
+
+async def get_posts(session):
+    if "cursor" in request.args:
+        return None
+
+    page = await paginate(session, Post, current_app.config["FLASKY_POSTS_PER_PAGE"])
+    return conditional_json(
+        page.etag(),
+        None,
+        lambda: {
+            "posts": posts_to_json(page.items),
+            "prev_url": page.prev_url("api.get_posts"),
+            "next_url": page.next_url("api.get_posts"),
+            "count": page.total,
+        },
+    )
+
+
+async def get_post(session, id: int):
+    post = await get_or_404(session, Post, id)
+    return conditional_json(row_etag(post), post.updated, post.to_json)
+
+
+async def get_comments(session):
+    if "cursor" in request.args:
+        return None
+
+    page = await paginate(
+        session, Comment, current_app.config["FLASKY_COMMENTS_PER_PAGE"]
+    )
+    return conditional_json(
+        page.etag(),
+        None,
+        lambda: {
+            "comments": comments_to_json(page.items),
+            "prev": page.prev_url("api.get_comments"),
+            "next": page.next_url("api.get_comments"),
+            "count": page.total,
+        },
+    )
+
+
+async def get_comment(session, id: int):
+    comment = await get_or_404(session, Comment, id)
+    return conditional_json(row_etag(comment), comment.updated, comment.to_json)
+
+
+async def get_user(session, id: int):
+    user = await get_or_404(session, User, id)
+    return conditional_json(row_etag(user), user.updated, user.to_json)
+
+
+ASYNC_VIEWS: Dict[str, Callable] = {
+    "api.get_posts": get_posts,
+    "api.get_post": get_post,
+    "api.get_comments": get_comments,
+    "api.get_comment": get_comment,
+    "api.get_user": get_user,
+}
+
+
+def environ_from_scope(scope: Dict[str, Any]) -> Dict[str, Any]:
+    """A WSGI environ for a bodiless ASGI HTTP request."""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    script_name = scope.get("root_path", "")
+    path = scope["path"]
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": script_name.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path[len(script_name) :].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("ascii"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+    }
+    for name, value in scope["headers"]:
+        key = name.decode("latin-1").upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
+
+
+class AsyncAPI:
+    """ASGI application answering ASYNC_VIEWS on the event loop."""
+
+    def __init__(self, app) -> None:
+        from asgiref.wsgi import WsgiToAsgi
+
+        self.app = app
+        self.wsgi = WsgiToAsgi(app)
+        async_db.init_app(app)
+
+    async def __call__(self, scope, receive, send) -> None:
+        response = None
+        if scope["type"] == "http" and scope["method"] == "GET":
+            with self.app.request_context(environ_from_scope(scope)):
+                response = await self.dispatch()
+
+        if response is None:
+            await self.wsgi(scope, receive, send)
+            return
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in response.headers.items()
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": response.get_data()})
+
+    async def dispatch(self) -> Any:
+        """The response of the request's async view, or None to use the Flask app."""
+        rule = request.url_rule
+        view = ASYNC_VIEWS.get(rule.endpoint) if rule is not None else None
+        if view is None:
+            return None
+
+        async with async_db.session() as session:
+            if await authenticate(session) is None:
+                return None
+
+            try:
+                rv = await view(session, **request.view_args)
+            except HTTPException as e:
+                rv = self.app.handle_user_exception(e)
+
+        return None if rv is None else self.app.make_response(rv)
@@ -1,35 +1,118 @@
-"""[summary]."""
+"""Authentication for the api blueprint.
 
-from typing import Any
+Verified credentials are cached for FLASKY_AUTH_CACHE_TIMEOUT seconds, keyed
+by token or by email and a keyed digest of the password, so repeat requests
+skip the token signature check and the password hash. A cached entry is
+only honoured while the user's email, password hash, role and confirmation
+status are unchanged. Passwords are only cached when SECRET_KEY is set.
+"""
 
-from flask import g, jsonify
+import hashlib
+import hmac
+import time
+from typing import Any, Optional
+
+from flask import current_app, g, jsonify
 from flask_httpauth import HTTPBasicAuth
 
 from . import api
 from .errors import forbidden, unauthorised
+from ..cache import MemoryBackend
 from ..models import User
 
 auth = HTTPBasicAuth()
 
 
+def get_credential_cache() -> MemoryBackend:
+    extensions = current_app.extensions
+    if "credential_cache" not in extensions:
+        extensions["credential_cache"] = MemoryBackend(
+            current_app.config["FLASKY_AUTH_CACHE_SIZE"],
+            current_app.config["FLASKY_AUTH_CACHE_TIMEOUT"],
+        )
+
+    return extensions["credential_cache"]
+
+
+def _cached_user(key: Any) -> Optional[User]:
+    cache = get_credential_cache()
+    entry = cache.get(key)
+    if entry is None:
+        return None
+
+    user_id, fingerprint = entry
+    user = User.query.get(user_id)
+    if user is None or user.credentials_fingerprint() != fingerprint:
+        cache.delete(key)
+        return None
+
+    return user
+
+
+def _cache_user(key: Any, user: User, expires: Optional[float] = None) -> None:
+    timeout = current_app.config["FLASKY_AUTH_CACHE_TIMEOUT"]
+    if expires is not None:
+        timeout = min(timeout, expires - time.time())
+
+    if timeout > 0:
+        entry = (user.id, user.credentials_fingerprint())
+        get_credential_cache().set(key, entry, timeout)
+
+
+def _password_key(email: str, password: str) -> Optional[Any]:
+    """The cache key of an email and password, or None without a SECRET_KEY."""
+    secret_key = current_app.config["SECRET_KEY"]
+    if not secret_key:
+        return None
+
+    if isinstance(secret_key, str):
+        secret_key = secret_key.encode("utf-8")
+    digest = hmac.new(secret_key, password.encode("utf-8"), hashlib.sha256).hexdigest()
+    return ("password", email, digest)
+
+
+def _verify_token(token: str) -> Optional[User]:
+    key = ("token", token)
+    user = _cached_user(key)
+    if user is None:
+        user, expires = User.load_auth_token(token)
+        if user is not None:
+            _cache_user(key, user, expires)
+
+    return user
+
+
 @auth.verify_password
 def verify_password(email_or_token: str, password: str) -> bool:
     if email_or_token == "":
         return False
 
     if password == "":
-        g.current_user = User.verify_auth_token(email_or_token)
+        g.current_user = _verify_token(email_or_token)
         g.token_used = True
         return g.current_user is not None
 
-    user = User.query.filter_by(email=email_or_token.lower()).first()
+    email = email_or_token.lower()
+    key = _password_key(email, password)
+    user = _cached_user(key) if key is not None else None
+    if user is not None:
+        g.current_user = user
+        g.token_used = False
+        return True
+
+    user = User.query.filter_by(email=email).first()
     if not user:
         return False
 
     g.current_user = user
     g.token_used = False
 
-    return user.verify_password(password)
+    if not user.verify_password(password):
+        return False
+
+    if key is not None:
+        _cache_user(key, user)
+    return True
 
 
 @auth.error_handler
@@ -0,0 +1,94 @@
+"""Helpers for the batch create endpoints of the api blueprint.
+
+A batch is a JSON array of the documents the single-item endpoints accept.
+Items are validated one by one; the valid ones are inserted in a single
+transaction and the response reports the outcome of every item by its index
+in the array: 201 when all were created, 207 when only some were and 400 when
+none were.
+"""
+from typing import Any, Callable, Dict, List, Tuple
+
+from app.exceptions import ValidationError
+from flask import current_app, jsonify
+
+from .. import db
+
+
+def build_batch(
+    data: Any, from_json: Callable[[Dict[str, Any]], Any]
+) -> Tuple[List[Tuple[int, Any]], List[Dict[str, Any]]]:
+    """Validate every item of `data` with `from_json`.
+
+    Returns:
+        tuple: The (index, object) pairs built and the error results.
+    """
+    if not isinstance(data, list):
+        raise ValidationError("Expected a JSON array")
+
+    limit = current_app.config["FLASKY_API_BATCH_SIZE"]
+    if len(data) > limit:
+        raise ValidationError(f"A batch holds at most {limit} items")
+
+    built = []
+    errors = []
+    for index, item in enumerate(data):
+        try:
+            if not isinstance(item, dict):
+                raise ValidationError("Expected a JSON object")
+            built.append((index, from_json(item)))
+        except ValidationError as e:
+            errors.append(
+                {
+                    "index": index,
+                    "status": 400,
+                    "error": "bad request",
+                    "message": e.args[0],
+                }
+            )
+
+    return built, errors
+
+
+def commit_batch(built: List[Tuple[int, Any]]) -> List[int]:
+    """Insert the built objects in one transaction.
+
+    Returns:
+        list: The ids of the new rows, read before the commit expires them.
+    """
+    db.session.add_all([obj for _, obj in built])
+    db.session.flush()
+    ids = [obj.id for _, obj in built]
+    db.session.commit()
+    return ids
+
+
+def batch_response(
+    model,
+    built: List[Tuple[int, Any]],
+    ids: List[int],
+    errors: List[Dict[str, Any]],
+    key: str,
+    serialize: Callable[[List[Any]], List[Dict[str, Any]]],
+) -> Any:
+    """Report each item of a batch committed by commit_batch, in the order it was sent."""
+    # reload the committed rows in one query rather than one refresh per row
+    if ids:
+        model.query.filter(model.id.in_(ids)).all()
+
+    results = errors + [
+        {"index": index, "status": 201, key: doc}
+        for (index, _), doc in zip(built, serialize([obj for _, obj in built]))
+    ]
+    results.sort(key=lambda result: result["index"])
+
+    if not errors:
+        status = 201
+    elif built:
+        status = 207
+    else:
+        status = 400
+
+    return (
+        jsonify({"results": results, "created": len(built), "failed": len(errors)}),
+        status,
+    )
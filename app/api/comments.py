@@ -1,68 +1,61 @@
 from flask import current_app, g, jsonify, request, url_for
 
 from . import api
+from .batch import batch_response, build_batch, commit_batch
+from .conditional import conditional_json, row_etag
 from .decorators import permission_required
+from .pagination import paginate
+from .serializers import comments_to_json
 from .. import db
 from ..models import Comment, Permission, Post
 
 
 @api.route("/comments/")
 def get_comments():
-    page = request.args.get("page", 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page, per_page=current_app.config["FLASKY_COMMENTS_PER_PAGE"], error_out=False
+    page = paginate(
+        Comment.query,
+        Comment.timestamp,
+        Comment.id,
+        current_app.config["FLASKY_COMMENTS_PER_PAGE"],
     )
 
-    comments = pagination.items
-
-    prev = None
-    if pagination.has_prev:
-        prev = url_for("api.get_comments", page=page - 1)
-
-    next = None
-    if pagination.has_next:
-        next = url_for("api.get_comments", page=page + 1)
-
-    return jsonify(
-        {
-            "comments": [comment.to_json() for comment in comments],
-            "prev": prev,
-            "next": next,
-            "count": pagination.total,
-        }
+    return conditional_json(
+        page.etag(),
+        None,
+        lambda: {
+            "comments": comments_to_json(page.items),
+            "prev": page.prev_url("api.get_comments"),
+            "next": page.next_url("api.get_comments"),
+            "count": page.total,
+        },
     )
 
 
 @api.route("/comments/<int:id>")
 def get_comment(id):
-    comment = Comment.get_or_404(id)
-    return jsonify(comment.to_json())
+    comment = Comment.query.get_or_404(id)
+    return conditional_json(row_etag(comment), comment.updated, comment.to_json)
 
 
 @api.route("/posts/<int:id>/comments/")
 def get_post_comments(id):
     post = Post.query.get_or_404(id)
-    page = request.args.get("page", 1, type=int)
-    pagination = post.comments.order_by(Comment.timestamp.desc()).paginate(
-        page, per_page=current_app.config["FLASKY_COMMENTS_PER_PAGE"], error_out=False
+    page = paginate(
+        post.comments,
+        Comment.timestamp,
+        Comment.id,
+        current_app.config["FLASKY_COMMENTS_PER_PAGE"],
     )
-    comments = pagination.items
-
-    prev = None
-    if pagination.has_prev:
-        prev = url_for("api.get_post_comments", page=page - 1)
-
-    next = None
-    if pagination.has_next:
-        next = url_for("api.get_post_comments", page=page + 1)
-
-    return jsonify(
-        {
-            "comments": [comment.to_json() for comment in comments],
-            "prev": prev,
-            "next": next,
-            "count": pagination.total,
-        }
+
+    return conditional_json(
+        page.etag(),
+        None,
+        lambda: {
+            "comments": comments_to_json(page.items),
+            "prev": page.prev_url("api.get_post_comments", id=id),
+            "next": page.next_url("api.get_post_comments", id=id),
+            "count": page.total,
+        },
     )
 
 
@@ -76,10 +69,24 @@ def new_post_comment(id):
     comment.post = post
 
     db.session.add(comment)
-    db.session.comment()
+    db.session.commit()
 
     return (
         jsonify(comment.to_json()),
         201,
         {"Location": url_for("api.get_comment", id=comment.id)},
     )
+
+
+@api.route("/posts/<int:id>/comments/batch", methods=["POST"])
+@permission_required(Permission.COMMENT)
+def new_post_comments(id):
+    post = Post.query.get_or_404(id)
+
+    built, errors = build_batch(request.json, Comment.from_json)
+    for _, comment in built:
+        comment.author = g.current_user
+        comment.post = post
+    ids = commit_batch(built)
+
+    return batch_response(Comment, built, ids, errors, "comment", comments_to_json)
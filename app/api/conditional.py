@@ -0,0 +1,62 @@
+"""Conditional GET support (ETag / Last-Modified) for the api blueprint.
+
+Every Post, Comment and User row carries an ``updated`` timestamp that is
+bumped by any UPDATE, including the counter and last_seen updates issued
+through SQLAlchemy Core. ETags are derived from it, so a request can be
+answered with 304 Not Modified before the JSON is serialised.
+"""
+from datetime import datetime
+import hashlib
+from typing import Any, Callable, Dict, Optional
+
+from flask import current_app, jsonify, request
+
+
+def make_etag(*parts: Any) -> str:
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def row_etag(row) -> Optional[str]:
+    if row.updated is None:
+        return None
+
+    return make_etag(row.__tablename__, row.id, row.updated.isoformat())
+
+
+def is_not_modified(etag: Optional[str], last_modified: Optional[datetime]) -> bool:
+    if etag is not None and request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    if last_modified is not None and request.if_modified_since is not None:
+        since = request.if_modified_since.replace(tzinfo=None)
+        return last_modified.replace(microsecond=0) <= since
+
+    return False
+
+
+def conditional_json(
+    etag: Optional[str],
+    last_modified: Optional[datetime],
+    serialize: Callable[[], Dict[str, Any]],
+) -> Any:
+    """Return `serialize()` as JSON, or a 304 if the client's copy is current.
+
+    Args:
+        etag (str): The resource's strong entity tag, if it has one.
+        last_modified (datetime): When the resource last changed, in UTC.
+        serialize (Callable): Builds the JSON body; only called on a miss.
+
+    Returns:
+        Response: The JSON or 304 Not Modified response.
+    """
+    if is_not_modified(etag, last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(serialize())
+
+    if etag is not None:
+        response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+
+    return response
@@ -0,0 +1,163 @@
+"""Offset and keyset (cursor) pagination for the api blueprint's list endpoints.
+
+Offset pagination (``?page=``) is the default. Passing ``?cursor=`` switches an
+endpoint to keyset pagination on (timestamp, id): an empty cursor returns the
+first page and every page then links to its neighbours with opaque cursors, so
+a deep page costs the same as the first one. The total row count is only
+computed in cursor mode when ``?count=1`` is also given.
+"""
+import base64
+from datetime import datetime
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.exceptions import ValidationError
+from flask import request, url_for
+
+from .conditional import make_etag
+from .. import db
+
+NEXT = "next"
+PREV = "prev"
+
+
+def encode_cursor(timestamp: datetime, id: int, direction: str) -> str:
+    data = json.dumps([timestamp.isoformat(), id, direction]).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int, str]:
+    try:
+        data = base64.urlsafe_b64decode(cursor.encode("ascii"))
+        timestamp, id, direction = json.loads(data.decode("utf-8"))
+        timestamp = datetime.fromisoformat(timestamp)
+    except (ValueError, TypeError):
+        raise ValidationError("Invalid cursor")
+
+    if not isinstance(id, int) or direction not in (NEXT, PREV):
+        raise ValidationError("Invalid cursor")
+
+    return timestamp, id, direction
+
+
+class Page:
+    """One page of results, with the query arguments of its neighbours."""
+
+    def __init__(
+        self,
+        items: List[Any],
+        total: Optional[int],
+        prev_args: Optional[Dict[str, Any]],
+        next_args: Optional[Dict[str, Any]],
+    ) -> None:
+        self.items = items
+        self.total = total
+        self.prev_args = prev_args
+        self.next_args = next_args
+
+    def etag(self) -> str:
+        """An entity tag covering the page's rows, links and count."""
+        rows = [(item.id, item.updated) for item in self.items]
+        return make_etag(rows, self.total, self.prev_args, self.next_args)
+
+    def prev_url(self, endpoint: str, **kwargs) -> Optional[str]:
+        if self.prev_args is None:
+            return None
+        return url_for(endpoint, **kwargs, **self.prev_args)
+
+    def next_url(self, endpoint: str, **kwargs) -> Optional[str]:
+        if self.next_args is None:
+            return None
+        return url_for(endpoint, **kwargs, **self.next_args)
+
+
+def paginate(query, timestamp, id, per_page: int) -> Page:
+    """Paginate `query` newest first, in the mode requested by the client.
+
+    Args:
+        query: The unordered query to paginate.
+        timestamp: The timestamp column to order by.
+        id: The id column that breaks ties between equal timestamps.
+        per_page (int): The number of items on a page.
+
+    Returns:
+        Page: The requested page.
+    """
+    if "cursor" in request.args:
+        return cursor_paginate(
+            query,
+            timestamp,
+            id,
+            request.args["cursor"],
+            per_page,
+            with_total=bool(request.args.get("count", 0, type=int)),
+        )
+
+    page = request.args.get("page", 1, type=int)
+    pagination = query.order_by(timestamp.desc(), id.desc()).paginate(
+        page, per_page=per_page, error_out=False
+    )
+
+    prev_args = None
+    if pagination.has_prev:
+        prev_args = {"page": page - 1}
+
+    next_args = None
+    if pagination.has_next:
+        next_args = {"page": page + 1}
+
+    return Page(pagination.items, pagination.total, prev_args, next_args)
+
+
+def cursor_paginate(
+    query, timestamp, id, cursor: str, per_page: int, with_total: bool = False
+) -> Page:
+    total = query.order_by(None).count() if with_total else None
+
+    direction = NEXT
+    if cursor:
+        after_timestamp, after_id, direction = decode_cursor(cursor)
+        if direction == NEXT:
+            query = query.filter(
+                db.or_(
+                    timestamp < after_timestamp,
+                    db.and_(timestamp == after_timestamp, id < after_id),
+                )
+            )
+        else:
+            query = query.filter(
+                db.or_(
+                    timestamp > after_timestamp,
+                    db.and_(timestamp == after_timestamp, id > after_id),
+                )
+            )
+
+    if direction == NEXT:
+        query = query.order_by(timestamp.desc(), id.desc())
+    else:
+        query = query.order_by(timestamp.asc(), id.asc())
+
+    # fetch one extra row to find out whether there is a page beyond this one
+    rows = query.add_columns(timestamp, id).limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == PREV:
+        rows.reverse()
+
+    has_prev = more if direction == PREV else bool(cursor)
+    has_next = more if direction == NEXT else True
+
+    prev_args = None
+    if rows and has_prev:
+        prev_args = {"cursor": encode_cursor(rows[0][1], rows[0][2], PREV)}
+
+    next_args = None
+    if rows and has_next:
+        next_args = {"cursor": encode_cursor(rows[-1][1], rows[-1][2], NEXT)}
+
+    if with_total:
+        for args in (prev_args, next_args):
+            if args is not None:
+                args["count"] = 1
+
+    return Page([row[0] for row in rows], total, prev_args, next_args)
@@ -1,42 +1,38 @@
 from flask import current_app, g, jsonify, request, url_for
 
 from . import api
+from .batch import batch_response, build_batch, commit_batch
+from .conditional import conditional_json, row_etag
 from .decorators import permission_required
 from .errors import forbidden
+from .pagination import paginate
+from .serializers import posts_to_json
 from .. import db
 from ..models import Permission, Post
 
 
 @api.route("/posts/")
 def get_posts() -> str:
-    page = request.args.get("page", 1, type=int)
-    pagination = Post.query.paginate(
-        page, per_page=current_app.config["FLASKY_POSTS_PER_PAGE"], error_out=False,
+    page = paginate(
+        Post.query, Post.timestamp, Post.id, current_app.config["FLASKY_POSTS_PER_PAGE"]
     )
-    posts = pagination.items
-
-    prev = None
-    if pagination.has_prev:
-        prev = url_for("api.get_posts", page=page - 1)
-
-    next = None
-    if pagination.has_next:
-        next = url_for("api.get_posts", page=page + 1)
-
-    return jsonify(
-        {
-            "posts": [post.to_json() for post in posts],
-            "prev_url": prev,
-            "next_url": next,
-            "count": pagination.total,
-        }
+
+    return conditional_json(
+        page.etag(),
+        None,
+        lambda: {
+            "posts": posts_to_json(page.items),
+            "prev_url": page.prev_url("api.get_posts"),
+            "next_url": page.next_url("api.get_posts"),
+            "count": page.total,
+        },
     )
 
 
 @api.route("/posts/<int:id>")
 def get_post(id: int) -> str:
     post = Post.query.get_or_404(id)
-    return jsonify(post.to_json())
+    return conditional_json(row_etag(post), post.updated, post.to_json)
 
 
 @api.route("/posts/", methods=["POST"])
@@ -47,11 +43,24 @@ def new_post():
     db.session.add(post)
     db.session.commit()
 
-    return jsonify(
-        post.to_json(), 201, {"Location": url_for("api.get_post", id=post.id)}
+    return (
+        jsonify(post.to_json()),
+        201,
+        {"Location": url_for("api.get_post", id=post.id)},
     )
 
 
+@api.route("/posts/batch", methods=["POST"])
+@permission_required(Permission.WRITE)
+def new_posts():
+    built, errors = build_batch(request.json, Post.from_json)
+    for _, post in built:
+        post.author = g.current_user
+    ids = commit_batch(built)
+
+    return batch_response(Post, built, ids, errors, "post", posts_to_json)
+
+
 @api.route("/posts/<int:id>", methods=["PUT"])
 def edit_post(id):
     post = Post.query.get_or_404(id)
@@ -0,0 +1,44 @@
+from app.exceptions import ValidationError
+from flask import current_app, jsonify, request, url_for
+
+from . import api
+from .serializers import comments_to_json, posts_to_json
+from ..models import Comment, Post
+from ..search import search as search_bodies
+
+
+@api.route("/search")
+def search():
+    q = request.args.get("q", "")
+    kind = request.args.get("type", "posts")
+    page = request.args.get("page", 1, type=int)
+
+    if kind == "posts":
+        query = search_bodies(Post, q)
+        per_page = current_app.config["FLASKY_POSTS_PER_PAGE"]
+        serialize = posts_to_json
+    elif kind == "comments":
+        query = search_bodies(Comment, q).filter(Comment.disabled.isnot(True))
+        per_page = current_app.config["FLASKY_COMMENTS_PER_PAGE"]
+        serialize = comments_to_json
+    else:
+        raise ValidationError("The search type must be posts or comments")
+
+    pagination = query.paginate(page, per_page=per_page, error_out=False)
+
+    prev = None
+    if pagination.has_prev:
+        prev = url_for("api.search", q=q, type=kind, page=page - 1)
+
+    next = None
+    if pagination.has_next:
+        next = url_for("api.search", q=q, type=kind, page=page + 1)
+
+    return jsonify(
+        {
+            kind: serialize(pagination.items),
+            "prev": prev,
+            "next": next,
+            "count": pagination.total,
+        }
+    )
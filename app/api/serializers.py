@@ -0,0 +1,75 @@
+"""List-level JSON serializers for the api blueprint.
+
+They produce the same documents as the models' ``to_json`` methods, but build
+each kind of URL once per list, with ``url_for``, and fill in the ids by
+string concatenation. The counts they report are the denormalized counter
+columns, and the author and post links only need the foreign keys, so
+serializing a page issues no queries beyond the one that loaded it.
+"""
+from typing import Any, Callable, Dict, Iterable, List
+
+from flask import url_for
+
+# an id no row will have, substituted by each row's own id
+_PLACEHOLDER = str(2 ** 62 + 1)
+
+
+def url_template(endpoint: str, **values) -> Callable[[int], str]:
+    """Return a function mapping an id to the URL of `endpoint` for that id."""
+    prefix, suffix = url_for(endpoint, id=int(_PLACEHOLDER), **values).split(
+        _PLACEHOLDER
+    )
+    return lambda id: f"{prefix}{id}{suffix}"
+
+
+def posts_to_json(posts: Iterable[Any]) -> List[Dict[str, Any]]:
+    post_url = url_template("api.get_post")
+    author_url = url_template("api.get_user")
+    comments_url = url_template("api.get_post_comments")
+    return [
+        {
+            "url": post_url(post.id),
+            "body": post.body,
+            "body_html": post.body_html,
+            "timestamp": post.timestamp,
+            "author_url": author_url(post.author_id),
+            "comments_url": comments_url(post.id),
+            "comments_count": post.comment_count,
+        }
+        for post in posts
+    ]
+
+
+def comments_to_json(comments: Iterable[Any]) -> List[Dict[str, Any]]:
+    comment_url = url_template("api.get_comment")
+    post_url = url_template("api.get_post")
+    author_url = url_template("api.get_user")
+    return [
+        {
+            "url": comment_url(comment.id),
+            "post_url": post_url(comment.post_id),
+            "body": comment.body,
+            "body_html": comment.body_html,
+            "timestamp": comment.timestamp,
+            "author_url": author_url(comment.author_id),
+        }
+        for comment in comments
+    ]
+
+
+def users_to_json(users: Iterable[Any]) -> List[Dict[str, Any]]:
+    user_url = url_template("api.get_user")
+    posts_url = url_template("api.get_user_posts")
+    timeline_url = url_template("api.get_user_followed_posts")
+    return [
+        {
+            "url": user_url(user.id),
+            "username": user.username,
+            "member_since": user.member_since,
+            "last_seen": user.last_seen,
+            "posts_url": posts_url(user.id),
+            "followed_posts_url": timeline_url(user.id),
+            "post_count": user.post_count,
+        }
+        for user in users
+    ]
@@ -1,66 +1,66 @@
-from flask import current_app, jsonify, request, url_for
+from flask import current_app, jsonify, request
 
 from . import api
+from .conditional import conditional_json, row_etag
+from .pagination import paginate
+from .serializers import posts_to_json, users_to_json
 from ..models import Post, User
 
 
 @api.route("/users/<int:id>")
 def get_user(id):
     user = User.query.get_or_404(id)
-    return jsonify(user.to_json())
+    return conditional_json(row_etag(user), user.updated, user.to_json)
 
 
 @api.route("/users/<int:id>/posts/")
 def get_user_posts(id):
     user = User.query.get_or_404(id)
-    page = request.args.get("page", 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config["FLASKY_POSTS_PER_PAGE"], error_out=False
+    page = paginate(
+        user.posts, Post.timestamp, Post.id, current_app.config["FLASKY_POSTS_PER_PAGE"]
     )
 
-    posts = pagination.items
-
-    prev = None
-    if pagination.has_prev:
-        prev = url_for("api.get_user_posts", id=id, page=page - 1)
-
-    next = None
-    if pagination.has_next:
-        next = url_for("api.get_user_posts", id=id, page=page + 1)
-
-    return jsonify(
-        {
-            "posts": [post.to_json() for post in posts],
-            "prev": prev,
-            "next": next,
-            "count": pagination.total,
-        }
+    return conditional_json(
+        page.etag(),
+        None,
+        lambda: {
+            "posts": posts_to_json(page.items),
+            "prev": page.prev_url("api.get_user_posts", id=id),
+            "next": page.next_url("api.get_user_posts", id=id),
+            "count": page.total,
+        },
     )
 
 
 @api.route("/users/<int:id>/timeline/")
 def get_user_followed_posts(id):
     user = User.query.get_or_404(id)
-    page = request.args.get("page", 1, type=int)
-    pagination = user.followed_posts.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config["FLASKY_POSTS_PER_PAGE"], error_out=False
+    query, timestamp, post_id = user.timeline_keyset()
+    page = paginate(
+        query, timestamp, post_id, current_app.config["FLASKY_POSTS_PER_PAGE"]
     )
 
-    posts = pagination.items
-
-    prev = None
-    if pagination.has_prev:
-        prev = url_for("api.get_user_followed_posts", id=id, page=page - 1)
+    return conditional_json(
+        page.etag(),
+        None,
+        lambda: {
+            "posts": posts_to_json(page.items),
+            "prev": page.prev_url("api.get_user_followed_posts", id=id),
+            "next": page.next_url("api.get_user_followed_posts", id=id),
+            "count": page.total,
+        },
+    )
 
-    next = None
-    if pagination.has_next:
-        next = url_for("api.get_user_followed_posts", id=id, page=page + 1)
 
-    return jsonify(
-        {
-            "posts": [post.to_json() for post in posts],
-            "prev": prev,
-            "next": next,
-            "count": pagination.total,
-        }
+@api.route("/users/<int:id>/suggestions/")
+def get_user_suggestions(id):
+    user = User.query.get_or_404(id)
+    limit = request.args.get(
+        "limit", current_app.config["FLASKY_FOLLOW_SUGGESTIONS"], type=int
     )
+    suggestions = user.suggested_users(max(0, min(limit, 100)))
+
+    users = users_to_json([suggestion for suggestion, _ in suggestions])
+    for json_user, (_, mutual_count) in zip(users, suggestions):
+        json_user["mutual_count"] = mutual_count
+    return jsonify({"users": users})
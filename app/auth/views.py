@@ -16,13 +16,14 @@ from .forms import (
 )
 from .. import db
 from ..email import send_email
+from ..last_seen import get_last_seen_buffer
 from ..models import User
 
 
 @auth.before_app_request
 def before_request() -> Any:
     if current_user.is_authenticated:
-        current_user.ping()
+        get_last_seen_buffer().record(current_user)
         if (
             not current_user.confirmed
             and request.endpoint
@@ -32,6 +33,15 @@ def before_request() -> Any:
             return redirect(url_for("auth.unconfirmed"))
 
 
+@auth.after_app_request
+def after_request(response: Any) -> Any:
+    buffer = get_last_seen_buffer()
+    if buffer.is_due():
+        buffer.flush()
+
+    return response
+
+
 @auth.route("/unconfirmed")
 def unconfirmed() -> Any:
     if current_user.is_anonymous or current_user.confirmed:
@@ -0,0 +1,435 @@
+"""Benchmarks for the application's hot endpoints.
+
+Seeds a SQLite database with app.fake.seed, then drives the HTML views and
+the JSON API through the test client, recording per endpoint the p50/p95
+latency, the number of SQL queries per request and the peak memory
+allocated while serving one request. Results can be saved as JSON and
+compared with a stored baseline.
+
+run_concurrency() instead serves the API scenarios to many concurrent
+clients, once through the Flask app on a pool of threads and once through
+the ASGI application of app.api.aio on an event loop, and reports the
+throughput and latency of each.
+"""
+import asyncio
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional, Tuple
+
+from faker import Faker
+
+from . import create_app, db, fake
+from .cache import response_cache
+from .models import Comment, Post, Role, User
+
+Results = Dict[str, Dict[str, float]]
+
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "bench"  # noqa: S105
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """The nearest-rank percentile of `values`."""
+    ordered = sorted(values)
+    rank = max(1, int(round(percent / 100.0 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def create_bench_app(database: str, cache: bool = False):
+    app = create_app("testing")
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + database
+    app.config["FLASKY_RESPONSE_CACHE"] = "memory" if cache else None
+    # keep the bench user's last_seen writes out of the query counts
+    app.config["FLASKY_LAST_SEEN_INTERVAL"] = 24 * 60 * 60
+    response_cache.init_app(app)
+    return app
+
+
+def prepare(users: int, posts: int, chunk_size: int) -> User:
+    """Seed the database, unless it already holds data, and add the bench user."""
+    db.create_all()
+    if Role.query.count() == 0:
+        Role.insert_roles()
+
+    if Post.query.count() == 0:
+        # a fixed seed gives comparable datasets, and query counts, across runs
+        random.seed(0)
+        Faker.seed(0)
+        fake.seed(user_count=users, post_count=posts, chunk_size=chunk_size)
+
+    user = User.query.filter_by(email=BENCH_EMAIL).first()
+    if user is None:
+        # the benchmarked user follows the seeded users' most followed members
+        user = User(
+            email=BENCH_EMAIL,
+            username="bench",
+            password=BENCH_PASSWORD,
+            confirmed=True,
+            role=Role.query.filter_by(name="Administrator").first(),
+        )
+        db.session.add(user)
+        for followed in User.query.order_by(User.follower_count.desc()).limit(50):
+            user.follow(followed)
+        db.session.commit()
+
+    return user
+
+
+def scenarios(user: User) -> List[Tuple[str, str, bool]]:
+    """The (name, url, is_api) requests to benchmark."""
+    popular = User.query.order_by(User.follower_count.desc()).first()
+    post = Post.query.order_by(Post.comment_count.desc()).first()
+    comment = Comment.query.first()
+    deep_page = max(1, Post.query.count() // 10 // 2)
+
+    html = [
+        ("index", "/"),
+        ("index_deep_page", f"/?page={deep_page}"),
+        ("post", f"/post/{post.id}"),
+        ("user", f"/user/{popular.username}"),
+        ("followers", f"/followers/{popular.username}"),
+        ("followed_by", f"/followed_by/{user.username}"),
+        ("moderate", "/moderate"),
+    ]
+    api = [
+        ("api_posts", "/api/v1/posts/"),
+        ("api_posts_deep_page", f"/api/v1/posts/?page={deep_page}"),
+        ("api_posts_cursor", "/api/v1/posts/?cursor="),
+        ("api_post", f"/api/v1/posts/{post.id}"),
+        ("api_user", f"/api/v1/users/{popular.id}"),
+        ("api_user_posts", f"/api/v1/users/{popular.id}/posts/"),
+        ("api_timeline", f"/api/v1/users/{user.id}/timeline/"),
+        ("api_comments", "/api/v1/comments/"),
+        ("api_comment", f"/api/v1/comments/{comment.id}" if comment else None),
+        ("api_post_comments", f"/api/v1/posts/{post.id}/comments/"),
+    ]
+    return [(name, url, False) for name, url in html] + [
+        (name, url, True) for name, url in api if url is not None
+    ]
+
+
+def bench_api_headers() -> Dict[str, str]:
+    credentials = f"{BENCH_EMAIL}:{BENCH_PASSWORD}".encode("utf-8")
+    return {
+        "Authorization": "Basic " + b64encode(credentials).decode("utf-8"),
+        "Accept": "application/json",
+    }
+
+
+def measure(
+    app,
+    engines: List[Any],
+    user_id: int,
+    plan: List[Tuple[str, str, bool]],
+    repeat: int,
+    warmup: int,
+) -> Results:
+    """Time each planned request.
+
+    Must run outside an application context, so that every request gets a
+    fresh database session, as it would when served.
+    """
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+        session["_fresh"] = True
+
+    api_headers = bench_api_headers()
+    queries = [0]
+
+    def count_query(*args):
+        queries[0] += 1
+
+    for engine in engines:
+        db.event.listen(engine, "before_cursor_execute", count_query)
+    results: Results = {}
+    try:
+        for name, url, is_api in plan:
+            headers = api_headers if is_api else {}
+
+            def get():
+                response = client.get(url, headers=headers)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{name}: GET {url} -> {response.status}")
+
+            for _ in range(warmup):
+                get()
+
+            timings = []
+            queries[0] = 0
+            for _ in range(repeat):
+                start = time.perf_counter()
+                get()
+                timings.append((time.perf_counter() - start) * 1000)
+            query_count = queries[0]
+
+            tracemalloc.start()
+            get()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results[name] = {
+                "p50_ms": round(percentile(timings, 50), 3),
+                "p95_ms": round(percentile(timings, 95), 3),
+                "queries": round(query_count / repeat, 1),
+                "peak_kib": round(peak / 1024, 1),
+            }
+    finally:
+        for engine in engines:
+            db.event.remove(engine, "before_cursor_execute", count_query)
+
+    return results
+
+
+def run(
+    users: int = 500,
+    posts: int = 5000,
+    repeat: int = 50,
+    warmup: int = 5,
+    database: Optional[str] = None,
+    cache: bool = False,
+) -> Results:
+    """Seed (or reuse) a benchmark database and measure every scenario.
+
+    Args:
+        users (int): Users to seed into a new database.
+        posts (int): Posts to seed into a new database.
+        repeat (int): Timed requests per scenario.
+        warmup (int): Untimed requests per scenario before timing.
+        database (str): An SQLite file to reuse; a temporary one by default.
+        cache (bool): Whether to enable the anonymous response cache.
+
+    Returns:
+        Results: The measurements, keyed by scenario name.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_bench_app(database or os.path.join(tmp, "bench.sqlite"), cache)
+        with app.app_context():
+            user = prepare(users, posts, chunk_size=10000)
+            plan = scenarios(user)
+            user_id = user.id
+            engines = db.get_engines()
+
+        results = measure(app, engines, user_id, plan, repeat, warmup)
+        for engine in engines:
+            engine.dispose()
+
+    return results
+
+
+def measure_concurrency(
+    app, plan: List[Tuple[str, str, bool]], clients: int, requests: int
+) -> Results:
+    """Serve each planned API request `requests` times to `clients` threads."""
+    headers = bench_api_headers()
+    results: Results = {}
+    for name, url, _ in plan:
+
+        def get(_):
+            client = app.test_client()
+            start = time.perf_counter()
+            response = client.get(url, headers=headers)
+            if response.status_code != 200:
+                raise RuntimeError(f"{name}: GET {url} -> {response.status}")
+            return (time.perf_counter() - start) * 1000
+
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            list(executor.map(get, range(clients)))
+            start = time.perf_counter()
+            timings = list(executor.map(get, range(requests)))
+            elapsed = time.perf_counter() - start
+
+        results[name] = concurrency_result(timings, elapsed)
+
+    return results
+
+
+async def asgi_get(application, url: str, headers: Dict[str, str]) -> Tuple[int, bytes]:
+    """Send a GET request straight to an ASGI application."""
+    path, _, query = url.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("utf-8"),
+        "root_path": "",
+        "query_string": query.encode("ascii"),
+        "headers": [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in headers.items()
+        ],
+        "server": ("localhost", 80),
+        "client": ("127.0.0.1", 0),
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages[0]["status"], b"".join(m.get("body", b"") for m in messages[1:])
+
+
+async def measure_async_concurrency(
+    application, plan: List[Tuple[str, str, bool]], clients: int, requests: int
+) -> Results:
+    """Serve each planned API request `requests` times to `clients` tasks."""
+    headers = bench_api_headers()
+    results: Results = {}
+    for name, url, _ in plan:
+
+        async def get():
+            start = time.perf_counter()
+            status, _ = await asgi_get(application, url, headers)
+            if status != 200:
+                raise RuntimeError(f"{name}: GET {url} -> {status}")
+            return (time.perf_counter() - start) * 1000
+
+        async def client(count):
+            return [await get() for _ in range(count)]
+
+        await asyncio.gather(*(get() for _ in range(clients)))
+        start = time.perf_counter()
+        counts = [
+            requests // clients + (i < requests % clients) for i in range(clients)
+        ]
+        timings = sum(await asyncio.gather(*(client(n) for n in counts)), [])
+        elapsed = time.perf_counter() - start
+
+        results[name] = concurrency_result(timings, elapsed)
+
+    return results
+
+
+def concurrency_result(timings: List[float], elapsed: float) -> Dict[str, float]:
+    return {
+        "requests_per_s": round(len(timings) / elapsed, 1),
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+    }
+
+
+def run_concurrency(
+    users: int = 500,
+    posts: int = 5000,
+    clients: int = 16,
+    requests: int = 500,
+    database: Optional[str] = None,
+) -> Dict[str, Results]:
+    """Measure the API scenarios under concurrency, sync and async.
+
+    The sync path is the Flask app on `clients` threads, as a threaded WSGI
+    server would run it; the async path is app.api.aio's ASGI application
+    on one event loop, serving `clients` concurrent requests.
+
+    Returns:
+        dict: The measurements of the "sync" and "async" paths, each keyed
+        by scenario name.
+    """
+    from .aio import async_db
+    from .api.aio import AsyncAPI
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = database or os.path.join(tmp, "bench.sqlite")
+        app = create_bench_app(database)
+        with app.app_context():
+            plan = [
+                (name, url, is_api)
+                for name, url, is_api in scenarios(prepare(users, posts, 10000))
+                if is_api
+            ]
+            db.engine.dispose()
+
+        results = {"sync": measure_concurrency(app, plan, clients, requests)}
+        with app.app_context():
+            db.engine.dispose()
+
+        app = create_bench_app(database)
+        application = AsyncAPI(app)
+
+        async def measure_async():
+            try:
+                return await measure_async_concurrency(
+                    application, plan, clients, requests
+                )
+            finally:
+                with app.app_context():
+                    await async_db.engine.dispose()
+
+        results["async"] = asyncio.run(measure_async())
+        with app.app_context():
+            db.engine.dispose()
+
+    return results
+
+
+def compare(results: Results, baseline: Results, tolerance: float) -> List[str]:
+    """Describe every way `results` is worse than `baseline`.
+
+    Latencies may exceed the baseline by `tolerance` (a fraction); query
+    counts may not grow at all.
+    """
+    regressions = []
+    for name, expected in sorted(baseline.items()):
+        actual = results.get(name)
+        if actual is None:
+            regressions.append(f"{name}: missing from results")
+            continue
+
+        if actual["queries"] > expected["queries"]:
+            regressions.append(
+                f"{name}: {actual['queries']:g} queries per request, "
+                f"baseline {expected['queries']:g}"
+            )
+
+        for metric in ("p50_ms", "p95_ms"):
+            if actual[metric] > expected[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{name}: {metric} {actual[metric]:.2f}, "
+                    f"baseline {expected[metric]:.2f}"
+                )
+
+    return regressions
+
+
+def format_report(results: Results, baseline: Optional[Results] = None) -> str:
+    header = (
+        f"{'endpoint':<22}{'p50 ms':>10}{'p95 ms':>10}{'queries':>10}{'peak KiB':>10}"
+    )
+    lines = [header, "-" * len(header)]
+    for name, result in results.items():
+        line = (
+            f"{name:<22}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+            f"{result['queries']:>10g}{result['peak_kib']:>10.1f}"
+        )
+        if baseline and name in baseline:
+            change = result["p95_ms"] / baseline[name]["p95_ms"] - 1
+            line += f"  ({change:+.0%} p95)"
+        lines.append(line)
+
+    return "\n".join(lines)
+
+
+def format_concurrency_report(results: Dict[str, Results]) -> str:
+    header = f"{'endpoint':<22}{'mode':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+    lines = [header, "-" * len(header)]
+    for name in results["sync"]:
+        for mode in ("sync", "async"):
+            result = results[mode][name]
+            lines.append(
+                f"{name:<22}{mode:>6}{result['requests_per_s']:>10.1f}"
+                f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+            )
+
+    return "\n".join(lines)
@@ -0,0 +1,285 @@
+"""Server-side caching of the HTML pages served to anonymous users.
+
+The backend is chosen by FLASKY_RESPONSE_CACHE: ``"memory"`` keeps an LRU in
+the process, ``"filesystem"`` shares entries between processes through
+FLASKY_RESPONSE_CACHE_DIR and ``None`` disables caching. Every committed
+change to a post, comment, user or follow clears the cache.
+"""
+from collections import OrderedDict
+from functools import wraps
+import hashlib
+import json
+import os
+import tempfile
+from threading import Lock
+import time
+from typing import Any, Callable, Optional, Tuple
+
+from flask import current_app, has_app_context, make_response, request, session
+from flask_login import current_user
+
+Entry = Tuple[str, str]  # (body, mimetype)
+
+
+class MemoryBackend:
+    """A thread-safe LRU whose entries expire after `timeout` seconds."""
+
+    def __init__(self, max_entries: int, timeout: float) -> None:
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+
+            expires, entry = item
+            if expires < time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: Any, entry: Any, timeout: Optional[float] = None) -> None:
+        if timeout is None:
+            timeout = self.timeout
+
+        with self._lock:
+            self._entries[key] = (time.time() + timeout, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Any) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class FileSystemBackend:
+    """Entries stored as files in `directory`, shared between processes.
+
+    Clearing the cache only starts a new generation, named in a small file in
+    the directory: entries are looked up under the current generation, and
+    the files of older ones are deleted by the next sweep. Every
+    SWEEP_INTERVAL writes a process sweeps the directory, also deleting
+    expired entries and the oldest ones beyond `max_entries`.
+    """
+
+    SWEEP_INTERVAL = 100
+
+    def __init__(self, directory: str, timeout: int, max_entries: int) -> None:
+        self.directory = directory
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self._writes = 0
+        self._lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _generation(self) -> str:
+        try:
+            with open(os.path.join(self.directory, "generation")) as f:
+                return f.read().strip() or "0"
+        except OSError:
+            return "0"
+
+    def _path(self, key: str) -> str:
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{self._generation()}-{name}.json")
+
+    def _write(self, path: str, data: str) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, key: str) -> Optional[Entry]:
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                expires, body, mimetype = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if expires < time.time():
+            return None
+
+        return body, mimetype
+
+    def set(self, key: str, entry: Entry) -> None:
+        body, mimetype = entry
+        self._write(
+            self._path(key), json.dumps([time.time() + self.timeout, body, mimetype])
+        )
+
+        with self._lock:
+            self._writes += 1
+            sweep = self._writes % self.SWEEP_INTERVAL == 0
+        if sweep:
+            self.sweep()
+
+    def clear(self) -> None:
+        self._write(os.path.join(self.directory, "generation"), str(time.time_ns()))
+
+    def sweep(self) -> None:
+        """Delete old generations' and expired entries, then the oldest extras."""
+        prefix = self._generation() + "-"
+        stale = time.time() - self.timeout
+        entries = []
+        with os.scandir(self.directory) as it:
+            for item in it:
+                if not item.name.endswith(".json"):
+                    continue
+                try:
+                    mtime = item.stat().st_mtime
+                except OSError:
+                    continue
+                if item.name.startswith(prefix) and mtime >= stale:
+                    entries.append((mtime, item.path))
+                else:
+                    self._remove(item.path)
+
+        entries.sort()
+        for _, path in entries[: max(0, len(entries) - self.max_entries)]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class ResponseCache:
+    """Flask extension holding each application's response cache backend."""
+
+    def __init__(self, app=None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        kind = app.config.get("FLASKY_RESPONSE_CACHE")
+        timeout = app.config["FLASKY_RESPONSE_CACHE_TIMEOUT"]
+        if kind == "memory":
+            backend: Any = MemoryBackend(
+                app.config["FLASKY_RESPONSE_CACHE_SIZE"], timeout
+            )
+        elif kind == "filesystem":
+            backend = FileSystemBackend(
+                app.config["FLASKY_RESPONSE_CACHE_DIR"],
+                timeout,
+                app.config["FLASKY_RESPONSE_CACHE_SIZE"],
+            )
+        elif kind is None:
+            backend = None
+        else:
+            raise ValueError(f"Unknown response cache backend: {kind}")
+
+        app.extensions["response_cache"] = backend
+
+    @property
+    def backend(self) -> Any:
+        return current_app.extensions.get("response_cache")
+
+    def clear(self) -> None:
+        if has_app_context() and self.backend is not None:
+            self.backend.clear()
+
+
+response_cache = ResponseCache()
+
+
+def _cache_key() -> str:
+    return json.dumps(
+        [
+            request.endpoint,
+            request.view_args,
+            sorted(request.args.items(multi=True)),
+            request.scheme,
+            bool(request.cookies.get("show_followed", "")),
+        ],
+        sort_keys=True,
+    )
+
+
+def cached_for_anonymous(f):
+    """Serve the view's HTML from the response cache for anonymous GETs."""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        backend = response_cache.backend
+        if (
+            backend is None
+            or request.method != "GET"
+            or current_user.is_authenticated
+            or "_flashes" in session
+        ):
+            return f(*args, **kwargs)
+
+        key = _cache_key()
+        entry = backend.get(key)
+        if entry is not None:
+            body, mimetype = entry
+            return current_app.response_class(body, mimetype=mimetype)
+
+        response = make_response(f(*args, **kwargs))
+        if response.status_code == 200 and "Set-Cookie" not in response.headers:
+            backend.set(key, (response.get_data(as_text=True), response.mimetype))
+
+        return response
+
+    return decorated_function
+
+
+def invalidate_on_commit(
+    db,
+    *models,
+    clear: Optional[Callable] = None,
+    record: Optional[Callable[[str, Any], Any]] = None,
+    key: Any = None,
+) -> None:
+    """Call `clear` whenever a change to one of `models` commits.
+
+    By default `clear` empties the response cache. If `record` is given, it
+    is called at each flush with the kind of change, ``"new"``, ``"dirty"``
+    or ``"deleted"``, and each changed instance of `models`, and `clear` is
+    called with the list of the values it returned other than None, in flush
+    order. Until then the list is kept in ``session.info[key]``.
+    """
+    clear = clear or response_cache.clear
+    key = key or ("invalidate", clear)
+
+    def after_flush(session, flush_context):
+        for kind, instances in (
+            ("new", session.new),
+            ("dirty", session.dirty),
+            ("deleted", session.deleted),
+        ):
+            for instance in instances:
+                if isinstance(instance, models):
+                    value = record(kind, instance) if record else True
+                    if value is not None:
+                        session.info.setdefault(key, []).append(value)
+
+    def after_commit(session):
+        changes = session.info.pop(key, None)
+        if not changes:
+            return
+        if record:
+            clear(changes)
+        else:
+            clear()
+
+    def after_rollback(session):
+        session.info.pop(key, None)
+
+    db.event.listen(db.session, "after_flush", after_flush)
+    db.event.listen(db.session, "after_commit", after_commit)
+    db.event.listen(db.session, "after_rollback", after_rollback)
@@ -1,14 +1,163 @@
-from threading import Thread
+"""Outgoing email, delivered by a bounded pool of background workers.
+
+Messages are queued and sent in batches over a single SMTP connection per
+batch. A full queue blocks the sender for up to FLASKY_MAIL_ENQUEUE_TIMEOUT
+seconds and then makes one attempt to deliver the message in the calling
+thread, so a burst of mail slows requests down rather than growing without
+bound. When the connection to the mail server fails, workers retry the rest
+of the batch with exponential backoff; a message the server refuses, or that
+cannot be sent at all, is logged and dropped on its own.
+"""
+import atexit
+import queue
+import smtplib
+from threading import Lock, Thread
+import time
+from typing import List, Optional
 
 from flask import current_app, render_template
 from flask_mail import Message
 
 from . import mail
 
+_queues_lock = Lock()
+
+
+def is_connection_error(e: Exception) -> bool:
+    """Whether `e` is a failure of the SMTP connection, not of one message."""
+    if isinstance(e, smtplib.SMTPException):
+        return isinstance(
+            e,
+            (
+                smtplib.SMTPServerDisconnected,
+                smtplib.SMTPConnectError,
+                smtplib.SMTPHeloError,
+                smtplib.SMTPAuthenticationError,
+            ),
+        )
+    return isinstance(e, OSError)
+
+
+class MailQueue:
+    def __init__(self, app) -> None:
+        self.app = app
+        self.queue: queue.Queue = queue.Queue(app.config["FLASKY_MAIL_QUEUE_SIZE"])
+        self.workers: List[Thread] = []
+        self._lock = Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self.workers:
+                return
+
+            for i in range(self.app.config["FLASKY_MAIL_WORKERS"]):
+                worker = Thread(target=self.work, name=f"mail-worker-{i}", daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+            atexit.register(self.drain, self.app.config["FLASKY_MAIL_ENQUEUE_TIMEOUT"])
+
+    def send(self, msg: Message) -> None:
+        self.start()
+        try:
+            self.queue.put(
+                msg, timeout=self.app.config["FLASKY_MAIL_ENQUEUE_TIMEOUT"]
+            )
+        except queue.Full:
+            # the request has waited long enough, so no retries
+            self.deliver([msg], retries=0)
+
+    def work(self) -> None:
+        batch_size = self.app.config["FLASKY_MAIL_BATCH_SIZE"]
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self.deliver(batch)
+            except Exception:
+                # a message that can never be sent must not stop the worker
+                self.app.logger.exception("Dropping %d email(s)", len(batch))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def deliver(self, batch: List[Message], retries: Optional[int] = None) -> None:
+        """Send `batch` over one connection.
+
+        If the connection fails, what is left of the batch is retried up to
+        `retries` times, by default FLASKY_MAIL_RETRIES. Messages that fail
+        on their own are dropped.
+        """
+        if retries is None:
+            retries = self.app.config["FLASKY_MAIL_RETRIES"]
+        backoff = self.app.config["FLASKY_MAIL_RETRY_BACKOFF"]
+        pending = list(batch)
+
+        with self.app.app_context():
+            for attempt in range(retries + 1):
+                if attempt:
+                    time.sleep(backoff * 2 ** (attempt - 1))
+
+                try:
+                    with mail.connect() as connection:
+                        while pending:
+                            self._send(connection, pending[0])
+                            pending.pop(0)
+                except (smtplib.SMTPException, OSError):
+                    self.app.logger.warning(
+                        "Sending mail failed (attempt %d of %d)",
+                        attempt + 1,
+                        retries + 1,
+                        exc_info=True,
+                    )
+
+                if not pending:
+                    return
+
+            self.app.logger.error("Giving up on %d email(s)", len(pending))
+
+    def _send(self, connection, msg: Message) -> None:
+        """Send `msg`, logging and dropping it if it fails on its own."""
+        try:
+            connection.send(msg)
+        except Exception as e:
+            if is_connection_error(e):
+                raise
+            self.app.logger.error(
+                "Dropping undeliverable email to %s",
+                ", ".join(msg.send_to),
+                exc_info=True,
+            )
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued message has been handled.
+
+        Returns:
+            bool: False if `timeout` seconds passed first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+
+        return True
+
+
+def get_mail_queue(app=None) -> MailQueue:
+    app = app or current_app._get_current_object()
+    with _queues_lock:
+        if "mail_queue" not in app.extensions:
+            app.extensions["mail_queue"] = MailQueue(app)
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+    return app.extensions["mail_queue"]
 
 
 def send_email(to, subject, template, **kwargs):
@@ -20,6 +169,5 @@ def send_email(to, subject, template, **kwargs):
     )
     msg.body = render_template(template + ".txt", **kwargs)
     msg.html = render_template(template + ".html", **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    get_mail_queue(app).send(msg)
+    return msg
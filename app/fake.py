@@ -1,11 +1,17 @@
 """Set up fake data."""
+from datetime import datetime, timedelta
+import itertools
+import random
 from random import randint
+from typing import Any, Callable, Dict, List, Optional
 
 from faker import Faker
 from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
 
-from . import db
-from .models import Post, User
+from . import db, search
+from .models import Comment, email_hash, Follow, Post, Role, TimelineEntry, User
+from .rendering import comment_renderer, post_renderer
 
 
 def users(count: int = 100):
@@ -42,3 +48,227 @@ def posts(count: int = 100):
         db.session.add(p)
 
     db.session.commit()
+
+
+def _weights(count: int, distribution: str) -> List[float]:
+    """Cumulative weights for choosing among `count` items."""
+    if distribution == "uniform":
+        return list(itertools.accumulate([1.0] * count))
+    if distribution == "zipf":
+        return list(itertools.accumulate(1.0 / rank for rank in range(1, count + 1)))
+
+    raise ValueError(f"Unknown distribution: {distribution}")
+
+
+def _sample_count(mean: float) -> int:
+    """A long-tailed count with the given mean."""
+    if mean <= 0:
+        return 0
+    return round(random.expovariate(1.0 / mean))
+
+
+def _max_id(model) -> int:
+    return db.session.query(db.func.max(model.id)).scalar() or 0
+
+
+def _past(days: int = 365) -> datetime:
+    return datetime.utcnow() - timedelta(seconds=randint(0, days * 86400))
+
+
+def _seed_users(fake: Faker, count: int, chunk_size: int, report) -> List[int]:
+    role = Role.query.filter_by(default=True).first()
+    password_hash = generate_password_hash("password")
+    usernames = {username for (username,) in db.session.query(User.username)}
+    emails = {email for (email,) in db.session.query(User.email)}
+    first_id = _max_id(User)
+
+    done = 0
+    while done < count:
+        rows = []
+        for _ in range(min(chunk_size, count - done)):
+            username = fake.user_name()
+            while username in usernames:
+                username = f"{fake.user_name()}{randint(0, 10 ** 6)}"
+            usernames.add(username)
+
+            email = f"{username}@{fake.free_email_domain()}"
+            while email in emails:
+                email = f"{username}{randint(0, 10 ** 6)}@{fake.domain_name()}"
+            emails.add(email)
+
+            member_since = _past(days=3 * 365)
+            rows.append(
+                {
+                    "email": email,
+                    "username": username,
+                    "password_hash": password_hash,
+                    "role_id": role.id if role else None,
+                    "confirmed": True,
+                    "name": fake.name(),
+                    "location": fake.city(),
+                    "about_me": fake.sentence(),
+                    "member_since": member_since,
+                    "last_seen": member_since,
+                    "avatar_hash": email_hash(email),
+                }
+            )
+
+        db.session.bulk_insert_mappings(User, rows)
+        db.session.commit()
+        done += len(rows)
+        report("users", done, count)
+
+    return [
+        id
+        for (id,) in db.session.query(User.id)
+        .filter(User.id > first_id)
+        .order_by(User.id)
+    ]
+
+
+def _seed_follows(
+    user_ids: List[int],
+    popular: List[int],
+    weights: List[float],
+    mean: float,
+    chunk_size: int,
+    report,
+) -> None:
+    rows: List[Dict[str, Any]] = []
+    done = 0
+    for user_id in user_ids:
+        # every user follows themselves, as User.__init__ arranges
+        wanted = min(_sample_count(mean), len(user_ids) - 1)
+        followed = set()
+        while len(followed) < wanted:
+            followed.update(random.choices(popular, cum_weights=weights, k=wanted))
+            followed.discard(user_id)
+
+        followed = {user_id, *itertools.islice(followed, wanted)}
+        for followed_id in followed:
+            rows.append(
+                {
+                    "follower_id": user_id,
+                    "followed_id": followed_id,
+                    "timestamp": _past(),
+                }
+            )
+
+        if len(rows) >= chunk_size or user_id == user_ids[-1]:
+            db.session.bulk_insert_mappings(Follow, rows)
+            db.session.commit()
+            done += len(rows)
+            rows = []
+            report("follows", done, done)
+
+
+def _seed_posts(
+    texts: List[str],
+    popular: List[int],
+    weights: List[float],
+    count: int,
+    comments_per_post: float,
+    chunk_size: int,
+    report,
+) -> None:
+    post_html = dict(zip(texts, post_renderer.render_many(texts)))
+    comment_html = dict(zip(texts, comment_renderer.render_many(texts)))
+
+    done = 0
+    comments_done = 0
+    while done < count:
+        first_id = _max_id(Post)
+        authors = random.choices(
+            popular, cum_weights=weights, k=min(chunk_size, count - done)
+        )
+        rows = []
+        for author_id in authors:
+            body = random.choice(texts)
+            rows.append(
+                {
+                    "body": body,
+                    "body_html": post_html[body],
+                    "timestamp": _past(),
+                    "author_id": author_id,
+                }
+            )
+        db.session.bulk_insert_mappings(Post, rows)
+
+        comments = []
+        posts = db.session.query(Post.id, Post.timestamp).filter(Post.id > first_id)
+        for post_id, timestamp in posts:
+            for author_id in random.choices(
+                popular, k=_sample_count(comments_per_post)
+            ):
+                body = random.choice(texts)
+                comments.append(
+                    {
+                        "body": body,
+                        "body_html": comment_html[body],
+                        "timestamp": timestamp + timedelta(minutes=randint(1, 10080)),
+                        "disabled": False,
+                        "author_id": author_id,
+                        "post_id": post_id,
+                    }
+                )
+        db.session.bulk_insert_mappings(Comment, comments)
+        db.session.commit()
+
+        done += len(rows)
+        comments_done += len(comments)
+        report("posts", done, count)
+        report("comments", comments_done, comments_done)
+
+
+def seed(
+    user_count: int = 100,
+    post_count: int = 1000,
+    follows_per_user: float = 20,
+    comments_per_post: float = 2,
+    distribution: str = "zipf",
+    chunk_size: int = 10000,
+    text_pool: int = 1000,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+) -> None:
+    """Bulk-load a large, realistic dataset.
+
+    Rows are written with bulk_insert_mappings in chunks of `chunk_size`, one
+    commit per chunk, bypassing the per-row ORM events. Bodies are drawn from
+    a pool of `text_pool` texts, so each distinct body is rendered once, and
+    the denormalised counters and timelines are rebuilt at the end.
+
+    Args:
+        user_count (int): The number of users to create.
+        post_count (int): The number of posts to create.
+        follows_per_user (float): The mean number of users each user follows.
+        comments_per_post (float): The mean number of comments per post.
+        distribution (str): How authorship and followers are spread over the
+            users: "zipf" (a few are very popular) or "uniform".
+        chunk_size (int): Rows inserted per commit.
+        text_pool (int): The number of distinct post and comment bodies.
+        progress (Callable): Called with (stage, done, total) after each chunk.
+    """
+    fake = Faker()
+    report = progress or (lambda stage, done, total: None)
+
+    user_ids = _seed_users(fake, user_count, chunk_size, report)
+    if not user_ids:
+        return
+
+    popular = list(user_ids)
+    random.shuffle(popular)
+    weights = _weights(len(popular), distribution)
+    _seed_follows(user_ids, popular, weights, follows_per_user, chunk_size, report)
+
+    texts = [fake.paragraph(nb_sentences=randint(1, 6)) for _ in range(text_pool)]
+    _seed_posts(
+        texts, popular, weights, post_count, comments_per_post, chunk_size, report
+    )
+
+    User.recount()
+    report("counters", 1, 1)
+    TimelineEntry.rebuild()
+    report("timelines", 1, 1)
+    search.reindex(Post)
+    search.reindex(Comment)
+    report("search", 1, 1)
@@ -0,0 +1,89 @@
+"""A cache of the ids of the users each user follows.
+
+User.followed_ids() keeps the set on the User instance for as long as its
+state is loaded, and in a per-process LRU shared by requests. A user's entry
+is dropped from the LRU when a change to their follows commits; entries
+expire after FLASKY_FOLLOW_CACHE_TIMEOUT seconds, which bounds how stale
+another process's copy can be. Sets read while the session holds uncommitted
+follow changes of the same user are never shared.
+"""
+from typing import Any, FrozenSet, Iterable, Optional
+
+from flask import current_app, has_app_context
+
+from .cache import invalidate_on_commit, MemoryBackend
+
+# session.info key of the follower ids whose follows changed in the transaction
+FOLLOW_CHANGES = "follow_changes"
+
+
+class FollowCache:
+    """Flask extension holding each application's followed-ids LRU."""
+
+    def __init__(self, app=None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        size = app.config["FLASKY_FOLLOW_CACHE_SIZE"]
+        app.extensions["follow_cache"] = (
+            MemoryBackend(size, app.config["FLASKY_FOLLOW_CACHE_TIMEOUT"])
+            if size
+            else None
+        )
+
+    @property
+    def backend(self) -> Any:
+        if not has_app_context():
+            return None
+        return current_app.extensions.get("follow_cache")
+
+    def get(self, user_id: int) -> Optional[FrozenSet[int]]:
+        backend = self.backend
+        return None if backend is None else backend.get(user_id)
+
+    def set(self, user_id: int, followed_ids: FrozenSet[int]) -> None:
+        backend = self.backend
+        if backend is not None:
+            backend.set(user_id, followed_ids)
+
+    def delete(self, user_ids: Iterable[int]) -> None:
+        backend = self.backend
+        if backend is not None:
+            for user_id in user_ids:
+                backend.delete(user_id)
+
+    def clear(self) -> None:
+        backend = self.backend
+        if backend is not None:
+            backend.clear()
+
+
+follow_cache = FollowCache()
+
+
+def follows_changed(session, user, follow_model) -> bool:
+    """Whether `session` holds uncommitted follows or unfollows by `user`."""
+    if user.id in session.info.get(FOLLOW_CHANGES, ()):
+        return True
+
+    return any(
+        isinstance(instance, follow_model)
+        and (instance.follower is user or instance.follower_id == user.id)
+        for instance in list(session.new) + list(session.deleted)
+    )
+
+
+def invalidate_follows_on_commit(db, follow_model) -> None:
+    """Drop a user's cached followed ids whenever a change to their follows commits."""
+
+    def follower_id(kind, follow):
+        return None if kind == "dirty" else follow.follower_id
+
+    invalidate_on_commit(
+        db,
+        follow_model,
+        clear=follow_cache.delete,
+        record=follower_id,
+        key=FOLLOW_CHANGES,
+    )
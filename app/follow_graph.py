@@ -0,0 +1,213 @@
+"""An in-memory index of the follow graph, for mutual follows and suggestions.
+
+Each user's followed and follower ids are kept in sorted ``array("q")``
+adjacency lists, 8 bytes per edge per direction. The index is loaded from
+the follows table on first use and kept up to date by applying every
+committed follow and unfollow. Changes committed by other processes are
+picked up by a full reload once the index is FLASKY_FOLLOW_GRAPH_TTL seconds
+old. Only one request reloads at a time; the others keep using the current
+index meanwhile, and changes applied during the reload are replayed onto the
+new one. Updates replace a user's arrays rather than modifying them, so
+readers never need the lock.
+
+Self-follows are stored like any other edge but never reported.
+"""
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+import heapq
+from threading import Lock
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from flask import current_app, has_app_context
+
+from .cache import invalidate_on_commit
+
+EMPTY = array("q")
+
+_graphs_lock = Lock()
+
+
+def _contains(ids: array, id: int) -> bool:
+    i = bisect_left(ids, id)
+    return i < len(ids) and ids[i] == id
+
+
+def intersection_size(a: array, b: array) -> int:
+    """The number of ids two sorted arrays have in common."""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(1 for id in a if _contains(b, id))
+
+
+class FollowGraph:
+    def __init__(self) -> None:
+        self.followed: Dict[int, array] = {}
+        self.followers: Dict[int, array] = {}
+        self.loaded: Optional[float] = None
+        self._lock = Lock()
+        self._loading = Lock()
+        # changes applied while a load reads its edges, replayed after the swap
+        self._replay: Optional[List[Tuple[bool, int, int]]] = None
+
+    def is_stale(self, ttl: float) -> bool:
+        return self.loaded is None or time.monotonic() - self.loaded > ttl
+
+    def refresh(self, ttl: float, read_edges: Callable[[], Iterable]) -> None:
+        """Reload the index from `read_edges()` once it is `ttl` seconds old.
+
+        Only one thread reloads at a time. The others carry on with the
+        current index, or wait for the first load if there is none yet.
+        """
+        if not self.is_stale(ttl):
+            return
+
+        if not self._loading.acquire(blocking=self.loaded is None):
+            return
+        try:
+            if self.is_stale(ttl):
+                self.load(read_edges())
+        finally:
+            self._loading.release()
+
+    def load(self, edges: Iterable[Tuple[int, int]]) -> None:
+        """Replace the index with `edges`, (follower_id, followed_id) pairs.
+
+        Changes applied while `edges` is read are replayed onto the new index;
+        replaying a change the edges already include has no effect.
+        """
+        with self._lock:
+            self._replay = []
+
+        followed: Dict[int, array] = {}
+        followers: Dict[int, array] = {}
+        for follower_id, followed_id in edges:
+            followed.setdefault(follower_id, array("q")).append(followed_id)
+            followers.setdefault(followed_id, array("q")).append(follower_id)
+
+        for adjacency in (followed, followers):
+            for id, ids in adjacency.items():
+                adjacency[id] = array("q", sorted(ids))
+
+        with self._lock:
+            self.followed = followed
+            self.followers = followers
+            replay, self._replay = self._replay, None
+            for added, follower_id, followed_id in replay or ():
+                self._change(added, follower_id, followed_id)
+            self.loaded = time.monotonic()
+
+    def add(self, follower_id: int, followed_id: int) -> None:
+        with self._lock:
+            self._record(True, follower_id, followed_id)
+            self._change(True, follower_id, followed_id)
+
+    def remove(self, follower_id: int, followed_id: int) -> None:
+        with self._lock:
+            self._record(False, follower_id, followed_id)
+            self._change(False, follower_id, followed_id)
+
+    def _record(self, added: bool, follower_id: int, followed_id: int) -> None:
+        if self._replay is not None:
+            self._replay.append((added, follower_id, followed_id))
+
+    def _change(self, added: bool, follower_id: int, followed_id: int) -> None:
+        if added:
+            self._insert(self.followed, follower_id, followed_id)
+            self._insert(self.followers, followed_id, follower_id)
+        else:
+            self._delete(self.followed, follower_id, followed_id)
+            self._delete(self.followers, followed_id, follower_id)
+
+    def apply(self, changes: Iterable[Tuple[bool, int, int]]) -> None:
+        """Apply (added, follower_id, followed_id) changes in order."""
+        for added, follower_id, followed_id in changes:
+            if added:
+                self.add(follower_id, followed_id)
+            else:
+                self.remove(follower_id, followed_id)
+
+    @staticmethod
+    def _insert(adjacency: Dict[int, array], key: int, id: int) -> None:
+        ids = adjacency.get(key, EMPTY)
+        if not _contains(ids, id):
+            ids = array("q", ids)
+            insort(ids, id)
+            adjacency[key] = ids
+
+    @staticmethod
+    def _delete(adjacency: Dict[int, array], key: int, id: int) -> None:
+        ids = adjacency.get(key, EMPTY)
+        i = bisect_left(ids, id)
+        if i < len(ids) and ids[i] == id:
+            adjacency[key] = ids[:i] + ids[i + 1 :]
+
+    def mutual_count(self, user_id: int, other_id: int) -> int:
+        """How many of the users `user_id` follows also follow `other_id`."""
+        followed = self.followed.get(user_id, EMPTY)
+        followers = self.followers.get(other_id, EMPTY)
+        count = intersection_size(followed, followers)
+        # neither user counts as a mutual follow of the other
+        for id in (user_id, other_id):
+            if _contains(followed, id) and _contains(followers, id):
+                count -= 1
+        return count
+
+    def suggestions(self, user_id: int, limit: int) -> List[Tuple[int, int]]:
+        """Users followed by the users `user_id` follows, but not by `user_id`.
+
+        Returns:
+            list: Up to `limit` (user id, mutual count) pairs, the users
+            followed by most of `user_id`'s followed users first.
+        """
+        followed = self.followed.get(user_id, EMPTY)
+        scores: Counter = Counter()
+        for friend_id in followed:
+            if friend_id != user_id:
+                scores.update(self.followed.get(friend_id, EMPTY))
+
+        candidates = (
+            (id, score)
+            for id, score in scores.items()
+            if id != user_id and not _contains(followed, id)
+        )
+        return heapq.nsmallest(
+            limit, candidates, key=lambda candidate: (-candidate[1], candidate[0])
+        )
+
+
+def get_follow_graph() -> FollowGraph:
+    """The current application's follow graph, loaded or reloaded as needed."""
+    from . import db
+    from .models import Follow
+
+    app = current_app._get_current_object()
+    with _graphs_lock:
+        graph = app.extensions.setdefault("follow_graph", FollowGraph())
+
+    graph.refresh(
+        app.config["FLASKY_FOLLOW_GRAPH_TTL"],
+        lambda: db.session.query(Follow.follower_id, Follow.followed_id).yield_per(
+            10000
+        ),
+    )
+    return graph
+
+
+def update_graph_on_commit(db, follow_model) -> None:
+    """Apply committed follows and unfollows to a loaded follow graph."""
+
+    def edge(kind, follow):
+        if kind == "dirty":
+            return None
+        return kind == "new", follow.follower_id, follow.followed_id
+
+    def apply(changes):
+        graph = (
+            current_app.extensions.get("follow_graph") if has_app_context() else None
+        )
+        if graph is not None and graph.loaded is not None:
+            graph.apply(changes)
+
+    invalidate_on_commit(db, follow_model, clear=apply, record=edge)
@@ -0,0 +1,123 @@
+"""Caching of rendered template fragments.
+
+Templates wrap a fragment in ``{% cache name, id, version, *variant %}`` ...
+``{% endcache %}``. The rendered HTML is stored under (name, id) in a
+per-process LRU of FLASKY_FRAGMENT_CACHE_SIZE objects. Each object holds the
+variants of its current version, such as its ``updated`` timestamp, one per
+combination of the other parts of the key that change what the fragment looks
+like, such as the viewer's relation to it; at most MAX_VARIANTS are kept. A
+new version replaces all of the older one's variants, and changing a post or
+comment body drops them at once.
+"""
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from flask import current_app, has_app_context
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+Key = Tuple[str, Any]
+
+MAX_VARIANTS = 16
+
+
+class FragmentStore:
+    """A thread-safe LRU of objects, each holding its rendered variants."""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Key, Tuple[Hashable, Dict[Hashable, str]]]" = (
+            OrderedDict()
+        )
+        self._lock = Lock()
+
+    def get(self, key: Key, version: Hashable, variant: Hashable) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or variant not in entry[1]:
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[1][variant]
+
+    def set(self, key: Key, version: Hashable, variant: Hashable, html: str) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or len(entry[1]) >= MAX_VARIANTS:
+                entry = self._entries[key] = (version, {})
+            entry[1][variant] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Key) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class FragmentCacheExtension(Extension):
+    """The ``{% cache name, id, version, *variant %}`` template tag."""
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("_render", [nodes.List(args)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, args, caller) -> str:
+        store = fragment_cache.store
+        if store is None or len(args) < 3:
+            return caller()
+
+        key = (args[0], args[1])
+        version = args[2]
+        variant = tuple(args[3:])
+        html = store.get(key, version, variant)
+        if html is None:
+            html = caller()
+            store.set(key, version, variant, html)
+
+        return Markup(html)
+
+
+class FragmentCache:
+    """Flask extension that enables the ``cache`` tag in the app's templates."""
+
+    def __init__(self, app=None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        size = app.config["FLASKY_FRAGMENT_CACHE_SIZE"]
+        app.extensions["fragment_cache"] = FragmentStore(size) if size else None
+        app.jinja_env.add_extension(FragmentCacheExtension)
+
+    @property
+    def store(self) -> Optional[FragmentStore]:
+        if not has_app_context():
+            return None
+        return current_app.extensions.get("fragment_cache")
+
+    def invalidate(self, name: str, id: Any) -> None:
+        store = self.store
+        if store is not None and id is not None:
+            store.delete((name, id))
+
+
+fragment_cache = FragmentCache()
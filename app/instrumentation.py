@@ -0,0 +1,145 @@
+"""Per-request SQL instrumentation.
+
+When FLASKY_SQL_INSTRUMENTATION is on, every query a request issues through
+the ``db`` engines, read replicas included, is counted and timed. The totals are reported in a
+Server-Timing header, statements repeated more than
+FLASKY_SQL_N_PLUS_ONE_THRESHOLD times are logged as likely N+1 queries, and
+queries slower than FLASKY_SLOW_DB_QUERY_TIME seconds are written to the
+slow-query log as JSON lines.
+"""
+from collections import Counter
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger("flasky.sql")
+
+
+class RequestQueries:
+    """The queries issued while serving one request."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Counter = Counter()
+        self.slow: List[Dict[str, Any]] = []
+
+    def record(self, statement: str, parameters: Any, duration: float) -> None:
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+        if duration >= current_app.config["FLASKY_SLOW_DB_QUERY_TIME"]:
+            entry = {"statement": statement, "duration_ms": round(duration * 1000, 3)}
+            if current_app.config["FLASKY_SQL_LOG_PARAMETERS"]:
+                entry["parameters"] = repr(parameters)
+            self.slow.append(entry)
+
+    def repeated(self, threshold: int) -> Dict[str, int]:
+        """Statements issued more than `threshold` times."""
+        return {
+            statement: count
+            for statement, count in self.statements.items()
+            if count > threshold
+        }
+
+    def server_timing(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        return (
+            f'db;dur={self.duration * 1000:.1f};desc="{self.count} queries", '
+            f"app;dur={elapsed * 1000:.1f}"
+        )
+
+
+def current_queries() -> Optional[RequestQueries]:
+    """The instrumented queries of the current request, if any."""
+    return g.get("_request_queries")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    if has_request_context() and current_queries() is not None:
+        context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    started = getattr(context, "_query_started", None)
+    queries = current_queries() if has_request_context() else None
+    if started is not None and queries is not None:
+        queries.record(statement, parameters, time.perf_counter() - started)
+
+
+class QueryInstrumentation:
+    """Flask extension that instruments each request's SQL queries."""
+
+    def __init__(self, app=None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        path = app.config.get("FLASKY_SLOW_QUERY_LOG")
+        if path and not any(
+            getattr(handler, "baseFilename", None) == path
+            for handler in logger.handlers
+        ):
+            handler = logging.FileHandler(path)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        app.teardown_request(self.discard)
+
+    def start(self) -> None:
+        if not current_app.config["FLASKY_SQL_INSTRUMENTATION"]:
+            return
+
+        # engines are created lazily and replaced when their URI changes
+        from . import db
+
+        for engine in db.get_engines():
+            if not event.contains(
+                engine, "before_cursor_execute", _before_cursor_execute
+            ):
+                event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+                event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+        g._request_queries = RequestQueries()
+
+    def finish(self, response: Any) -> Any:
+        queries = g.pop("_request_queries", None)
+        if queries is None:
+            return response
+
+        config = current_app.config
+        if config["FLASKY_SQL_SERVER_TIMING"]:
+            response.headers.add("Server-Timing", queries.server_timing())
+
+        context = {
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "endpoint": request.endpoint,
+        }
+        for statement, count in queries.repeated(
+            config["FLASKY_SQL_N_PLUS_ONE_THRESHOLD"]
+        ).items():
+            logger.warning(
+                json.dumps(
+                    dict(context, event="n_plus_one", statement=statement, count=count)
+                )
+            )
+
+        for entry in queries.slow:
+            logger.warning(json.dumps(dict(context, event="slow_query", **entry)))
+
+        return response
+
+    def discard(self, exc: Optional[BaseException]) -> None:
+        g.pop("_request_queries", None)
+
+
+query_instrumentation = QueryInstrumentation()
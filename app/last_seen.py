@@ -0,0 +1,91 @@
+"""Throttled, write-behind updates of User.last_seen.
+
+Each application has its own buffer, flushed after the requests that find it
+due and once more when the process exits.
+"""
+import atexit
+from datetime import datetime, timedelta
+from threading import Lock
+import time
+from typing import Dict, Optional
+
+from flask import current_app
+
+from . import db
+
+_buffers_lock = Lock()
+
+
+class LastSeenBuffer:
+    """Collects last_seen timestamps and writes them in a single UPDATE.
+
+    A user is only recorded when their last_seen is older than
+    FLASKY_LAST_SEEN_INTERVAL seconds. The buffer is due to be written once
+    its oldest entry is FLASKY_LAST_SEEN_FLUSH_INTERVAL seconds old or it holds
+    FLASKY_LAST_SEEN_BUFFER_SIZE users.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+        self._pending: Dict[int, datetime] = {}
+        self._since: Optional[float] = None
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def record(self, user) -> bool:
+        now = datetime.utcnow()
+        interval = timedelta(seconds=self.app.config["FLASKY_LAST_SEEN_INTERVAL"])
+        if user.last_seen is not None and now - user.last_seen < interval:
+            return False
+
+        with self._lock:
+            pending = self._pending.get(user.id)
+            if pending is not None and now - pending < interval:
+                return False
+
+            if not self._pending:
+                self._since = time.monotonic()
+            self._pending[user.id] = now
+
+        return True
+
+    def is_due(self) -> bool:
+        if not self._pending:
+            return False
+
+        age = time.monotonic() - self._since
+        return (
+            age >= self.app.config["FLASKY_LAST_SEEN_FLUSH_INTERVAL"]
+            or len(self._pending) >= self.app.config["FLASKY_LAST_SEEN_BUFFER_SIZE"]
+        )
+
+    def flush(self) -> int:
+        """Write the buffered timestamps and return how many users were updated."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return 0
+
+        from .models import User
+
+        with db.get_engine(self.app).begin() as connection:
+            connection.execute(
+                User.__table__.update()
+                .where(User.id.in_(pending))
+                .values(last_seen=db.case(pending, value=User.id))
+            )
+
+        return len(pending)
+
+
+def get_last_seen_buffer(app=None) -> LastSeenBuffer:
+    app = app or current_app._get_current_object()
+    with _buffers_lock:
+        if "last_seen" not in app.extensions:
+            buffer = app.extensions["last_seen"] = LastSeenBuffer(app)
+            atexit.register(buffer.flush)
+
+    return app.extensions["last_seen"]
@@ -17,11 +17,16 @@ from werkzeug import Response
 from . import main
 from .forms import CommentForm, EditProfileAdminForm, EditProfileForm, PostForm
 from .. import db
+from ..api.pagination import cursor_paginate
+from ..cache import cached_for_anonymous
 from ..decorators import admin_required, permission_required
+from ..exceptions import ValidationError
 from ..models import Comment, Permission, Post, Role, User
+from ..search import search as search_bodies
 
 
 @main.route("/", methods=["GET", "POST"])
+@cached_for_anonymous
 def index() -> Any:
     # form = NameForm()
     # if form.validate_on_submit():
@@ -68,26 +73,43 @@ def index() -> Any:
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get("show_followed", ""))
 
+    per_page = current_app.config["FLASKY_POSTS_PER_PAGE"]
+    pagination = timeline_page = None
     if show_followed:
-        query = current_user.followed_posts
+        # keyset pagination, so a page costs the same however long the timeline
+        query, timestamp, post_id = current_user.timeline_keyset()
+        try:
+            timeline_page = cursor_paginate(
+                query.options(db.selectinload(Post.author)),
+                timestamp,
+                post_id,
+                request.args.get("cursor", ""),
+                per_page,
+            )
+        except ValidationError:
+            abort(400)
+        posts = timeline_page.items
     else:
-        query = Post.query
+        query = Post.query.order_by(Post.timestamp.desc())
 
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config["FLASKY_POSTS_PER_PAGE"], error_out=False
-    )
-    posts = pagination.items
+        # load every author on the page in one query, not one per post
+        pagination = query.options(db.selectinload(Post.author)).paginate(
+            page, per_page=per_page, error_out=False
+        )
+        posts = pagination.items
 
     return render_template(
         "index.html",
         form=form,
         posts=posts,
         pagination=pagination,
+        timeline_page=timeline_page,
         show_followed=show_followed,
     )  # noqa
 
 
 @main.route("/user/<username>")
+@cached_for_anonymous
 def user(username: str) -> Any:
     user: Any = User.query.filter_by(username=username).first_or_404()
 
@@ -98,7 +120,19 @@ def user(username: str) -> Any:
     )
     posts = pagination.items
 
-    return render_template("user.html", user=user, posts=posts, pagination=pagination)
+    suggestions = []
+    if user == current_user:
+        suggestions = user.suggested_users(
+            current_app.config["FLASKY_FOLLOW_SUGGESTIONS"]
+        )
+
+    return render_template(
+        "user.html",
+        user=user,
+        posts=posts,
+        pagination=pagination,
+        suggestions=suggestions,
+    )
 
 
 @main.route("/edit-profile", methods=["GET", "POST"])
@@ -158,6 +192,7 @@ def edit_profile_admin(id: int) -> Any:
 
 
 @main.route("/post/<int:id>", methods=["GET", "POST"])
+@cached_for_anonymous
 def post(id: int):
     post = Post.query.get_or_404(id)
     form = CommentForm()
@@ -175,12 +210,18 @@ def post(id: int):
     page = request.args.get("page", 1, type=int)
 
     if page == -1:
-        page = (post.comments.count() - 1) // current_app.config[
+        page = (post.comment_count - 1) // current_app.config[
             "FLASKY_COMMENTS_PER_PAGE"
         ] + 1
 
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
-        page, per_page=current_app.config["FLASKY_COMMENTS_PER_PAGE"], error_out=False
+    pagination = (
+        post.comments.options(db.selectinload(Comment.author))
+        .order_by(Comment.timestamp.asc())
+        .paginate(
+            page,
+            per_page=current_app.config["FLASKY_COMMENTS_PER_PAGE"],
+            error_out=False,
+        )
     )
 
     comments = pagination.items
@@ -319,13 +360,48 @@ def show_followed() -> Response:
     return resp
 
 
+@main.route("/search")
+def search() -> Text:
+    q = request.args.get("q", "")
+    kind = request.args.get("type", "posts")
+    page = request.args.get("page", 1, type=int)
+
+    if kind == "comments":
+        query = (
+            search_bodies(Comment, q)
+            .filter(Comment.disabled.isnot(True))
+            .options(db.selectinload(Comment.author))
+        )
+        per_page = current_app.config["FLASKY_COMMENTS_PER_PAGE"]
+    else:
+        kind = "posts"
+        query = search_bodies(Post, q).options(db.selectinload(Post.author))
+        per_page = current_app.config["FLASKY_POSTS_PER_PAGE"]
+
+    pagination = query.paginate(page, per_page=per_page, error_out=False)
+    return render_template(
+        "search.html",
+        q=q,
+        type=kind,
+        posts=pagination.items if kind == "posts" else [],
+        comments=pagination.items if kind == "comments" else [],
+        pagination=pagination,
+    )
+
+
 @main.route("/moderate")
 @login_required
 @permission_required(Permission.MODERATE)
 def moderate() -> Text:
     page: int = request.args.get("page", 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page, per_page=current_app.config["FLASKY_COMMENTS_PER_PAGE"], error_out=False
+    pagination = (
+        Comment.query.options(db.selectinload(Comment.author))
+        .order_by(Comment.timestamp.desc())
+        .paginate(
+            page,
+            per_page=current_app.config["FLASKY_COMMENTS_PER_PAGE"],
+            error_out=False,
+        )
     )
     comments = pagination.items
     return render_template(
@@ -1,11 +1,12 @@
 """The data models for the application."""
 from datetime import datetime
+from functools import lru_cache
 import hashlib
-from typing import Any, Dict
+import time
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
 
 from app.exceptions import ValidationError
-import bleach
-from flask import current_app, request, url_for
+from flask import current_app, has_app_context, request, url_for
 from flask_login import UserMixin
 from flask_login.mixins import AnonymousUserMixin
 from itsdangerous import (
@@ -13,11 +14,37 @@ from itsdangerous import (
     SignatureExpired,
     TimedJSONWebSignatureSerializer as Serializer,
 )
-from markdown import markdown
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from . import db
 from . import login_manager
+from .cache import invalidate_on_commit
+from .follow_cache import follow_cache, follows_changed, invalidate_follows_on_commit
+from .follow_graph import get_follow_graph, update_graph_on_commit
+from .fragments import fragment_cache
+from .rendering import comment_renderer, post_renderer
+from .search import (
+    create_search_table,
+    drop_search_table,
+    index_body,
+    reindex_body,
+    unindex_body,
+)
+
+
+def email_hash(email: str) -> str:
+    return hashlib.md5(email.lower().encode("utf-8")).hexdigest()  # noqa
+
+
+@lru_cache(maxsize=8192)
+def avatar_url(hash: str, size: int, default: str, rating: str, secure: bool) -> str:
+    """A Gravatar URL, built once per process for each distinct argument set."""
+    if secure:
+        url = "https://secure.gravatar.com/avatar"
+    else:
+        url = "http://www.gravatar.com/avatar"
+
+    return f"{url}/{hash}?s={size}&d={default}&r={rating}"
 
 
 class Permission:
@@ -52,6 +79,33 @@ class Role(db.Model):
     def has_permissions(self, perm: int):
         return self.permissions & perm == perm
 
+    @staticmethod
+    def permissions_of(role_id: int) -> Optional[int]:
+        """The permissions of a role, from a cache of the whole roles table.
+
+        The cache is reloaded when it misses or is FLASKY_ROLE_CACHE_TIMEOUT
+        seconds old, which bounds how long changes committed by another
+        process, such as ``flask shell`` running Role.insert_roles, go
+        unseen. It is cleared whenever a change to a role commits in this
+        process.
+        """
+        loaded, roles = current_app.extensions.get("role_permissions", (0.0, None))
+        timeout = current_app.config["FLASKY_ROLE_CACHE_TIMEOUT"]
+        if (
+            roles is None
+            or role_id not in roles
+            or time.monotonic() - loaded >= timeout
+        ):
+            roles = dict(db.session.query(Role.id, Role.permissions))
+            current_app.extensions["role_permissions"] = (time.monotonic(), roles)
+
+        return roles.get(role_id)
+
+    @staticmethod
+    def clear_cache() -> None:
+        if has_app_context():
+            current_app.extensions.pop("role_permissions", None)
+
     @staticmethod
     def insert_roles():
         roles = {
@@ -100,11 +154,56 @@ class Role(db.Model):
 
 class Follow(db.Model):
     __tablename__ = "follows"
+    __table_args__ = (db.Index("ix_follows_followed_id", "followed_id"),)
     follower_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
     followed_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class TimelineEntry(db.Model):
+    """A post materialised into the timeline of one of its author's followers."""
+
+    __tablename__ = "timelines"
+    __table_args__ = (
+        db.Index("ix_timelines_user_id_timestamp", "user_id", "timestamp"),
+    )
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("posts.id"), primary_key=True)
+    timestamp = db.Column(db.DateTime)
+
+    @staticmethod
+    def rebuild(user_ids=None):
+        """Rebuild the timelines, for every user or just those in `user_ids`."""
+        limit = current_app.config["FLASKY_TIMELINE_FANOUT_LIMIT"]
+        popular = (
+            db.select([Follow.followed_id])
+            .group_by(Follow.followed_id)
+            .having(db.func.count() > limit)
+        )
+        User.query.update(
+            {User.timeline_fanout: ~User.id.in_(popular)}, synchronize_session=False
+        )
+        User.clear_popular_authors()
+
+        entries = TimelineEntry.query
+        follows = (
+            db.select([Follow.follower_id, Post.id, Post.timestamp])
+            .select_from(Follow.__table__.join(Post.__table__, _followed_author))
+            .where(Post.author_id.in_(db.select([User.id]).where(_fanout_enabled)))
+        )
+        if user_ids is not None:
+            entries = entries.filter(TimelineEntry.user_id.in_(user_ids))
+            follows = follows.where(Follow.follower_id.in_(user_ids))
+
+        entries.delete(synchronize_session=False)
+        db.session.execute(
+            TimelineEntry.__table__.insert().from_select(
+                ["user_id", "post_id", "timestamp"], follows
+            )
+        )
+        db.session.commit()
+
+
 class User(UserMixin, db.Model):
     __tablename__ = "users"
     id = db.Column(db.Integer, primary_key=True)
@@ -118,7 +217,14 @@ class User(UserMixin, db.Model):
     about_me = db.Column(db.Text())
     member_since = db.Column(db.DateTime(), default=datetime.utcnow)
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
+    updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     avatar_hash = db.Column(db.String(32))
+    timeline_fanout = db.Column(db.Boolean, default=True, index=True)
+    # denormalised counters, maintained by the mapper events below the models
+    post_count = db.Column(db.Integer, default=0, nullable=False)
+    comment_count = db.Column(db.Integer, default=0, nullable=False)
+    follower_count = db.Column(db.Integer, default=0, nullable=False)
+    followed_count = db.Column(db.Integer, default=0, nullable=False)
 
     posts = db.relationship("Post", backref="author", lazy="dynamic")
 
@@ -150,6 +256,53 @@ class User(UserMixin, db.Model):
             Follow.follower_id == self.id
         )
 
+    @property
+    def timeline(self):
+        """The followed posts, newest first."""
+        query, timestamp, id = self.timeline_keyset()
+        return query.order_by(timestamp.desc(), id.desc())
+
+    def timeline_keyset(self):
+        """The unordered timeline query and the (timestamp, id) columns to order it by.
+
+        Served from the materialised timeline unless the user follows an
+        author whose posts are too widely followed to be fanned out on write,
+        in which case the Follow/Post join is used instead.
+        """
+        if self.id is None or self.follows_popular_author():
+            return self.followed_posts, Post.timestamp, Post.id
+
+        query = Post.query.join(TimelineEntry, TimelineEntry.post_id == Post.id).filter(
+            TimelineEntry.user_id == self.id
+        )
+        return query, TimelineEntry.timestamp, TimelineEntry.post_id
+
+    def follows_popular_author(self) -> bool:
+        return not User.popular_author_ids().isdisjoint(self.followed_ids())
+
+    @staticmethod
+    def popular_author_ids() -> FrozenSet[int]:
+        """The ids of the authors whose posts are not fanned out on write.
+
+        Cached per application, like Role.permissions_of, and reloaded once
+        FLASKY_POPULAR_AUTHORS_TIMEOUT seconds old. Authors flagged by
+        another process are seen once the cache expires.
+        """
+        loaded, ids = current_app.extensions.get("popular_authors", (0.0, None))
+        timeout = current_app.config["FLASKY_POPULAR_AUTHORS_TIMEOUT"]
+        if ids is None or time.monotonic() - loaded >= timeout:
+            ids = frozenset(
+                id for id, in db.session.query(User.id).filter(_fanout_disabled)
+            )
+            current_app.extensions["popular_authors"] = (time.monotonic(), ids)
+
+        return ids
+
+    @staticmethod
+    def clear_popular_authors() -> None:
+        if has_app_context():
+            current_app.extensions.pop("popular_authors", None)
+
     @property
     def password(self):
         raise AttributeError("password is not a readable attribue")
@@ -239,8 +392,26 @@ class User(UserMixin, db.Model):
         return True
 
     # PERMISSIONS METHODS
+    def load_permissions(self) -> Optional[int]:
+        """The permission bitmask of the user's role, remembered on the instance.
+
+        Read from the role cache, so the Role row is never lazy-loaded.
+        """
+        role = self.__dict__.get("role")
+        if role is not None:
+            # already loaded, or assigned and possibly not yet flushed
+            return role.permissions
+
+        permissions = self.__dict__.get("_permissions")
+        if permissions is None and self.role_id is not None:
+            permissions = Role.permissions_of(self.role_id)
+            self._permissions = permissions
+
+        return permissions
+
     def can(self, perm: int) -> bool:
-        return self.role is not None and self.role.has_permissions(perm)
+        permissions = self.load_permissions()
+        return permissions is not None and permissions & perm == perm
 
     def is_administrator(self) -> bool:
         return self.can(Permission.ADMIN)
@@ -253,6 +424,32 @@ class User(UserMixin, db.Model):
                 db.session.add(user)
                 db.session.commit()
 
+    @staticmethod
+    def recount():
+        """Recompute the denormalised counters from the underlying tables."""
+
+        def count(column):
+            return db.select([db.func.count()]).where(column == User.id)
+
+        User.query.update(
+            {
+                User.post_count: count(Post.author_id).scalar_subquery(),
+                User.comment_count: count(Comment.author_id).scalar_subquery(),
+                User.follower_count: count(Follow.followed_id).scalar_subquery(),
+                User.followed_count: count(Follow.follower_id).scalar_subquery(),
+            },
+            synchronize_session=False,
+        )
+        Post.query.update(
+            {
+                Post.comment_count: db.select([db.func.count()])
+                .where(Comment.post_id == Post.id)
+                .scalar_subquery()
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+
     def __repr__(self) -> str:
         return f"<User {self.username} | role_id: {self.role_id} | role: {self.role}>"
 
@@ -271,39 +468,120 @@ class User(UserMixin, db.Model):
         self.follow(self)
 
     def gravatar_hash(self) -> str:
-        return hashlib.md5(self.email.lower().encode("utf-8")).hexdigest()  # noqa
+        return email_hash(self.email)
 
     def gravatar(self, size=100, default="identicon", rating="g"):
-        if request.is_secure:
-            url = "https://secure.gravatar.com/avatar"
-        else:
-            url = "http://www.gravatar.com/avatar"
-
         hash = self.avatar_hash or self.gravatar_hash()
+        return avatar_url(hash, size, default, rating, request.is_secure)
 
-        return f"{url}/{hash}?s={size}&d={default}&r={rating}"
+    @staticmethod
+    def backfill_avatar_hashes(chunk_size: int = 1000) -> int:
+        """Fill in every missing avatar_hash, `chunk_size` users per commit.
+
+        Returns:
+            int: The number of users updated.
+        """
+        done = 0
+        while True:
+            rows = (
+                db.session.query(User.id, User.email)
+                .filter(User.avatar_hash.is_(None), User.email.isnot(None))
+                .limit(chunk_size)
+                .all()
+            )
+            if not rows:
+                return done
+
+            db.session.bulk_update_mappings(
+                User,
+                [{"id": id, "avatar_hash": email_hash(email)} for id, email in rows],
+            )
+            db.session.commit()
+            done += len(rows)
 
     def follow(self, user):
-        if not self.is_following(user):
+        # checked in the database, as the shared follow cache may be stale
+        if (
+            user.id is None
+            or self.followed.filter_by(followed_id=user.id).first() is None
+        ):
             f = Follow(follower=self, followed=user)
             db.session.add(f)
+            self._update_followed_ids(user, True)
 
     def unfollow(self, user):
         f = self.followed.filter_by(followed_id=user.id).first()
         if f:
             db.session.delete(f)
+            self._update_followed_ids(user, False)
+
+    def followed_ids(self) -> FrozenSet[int]:
+        """The ids of the users this user follows, themselves included.
+
+        Loaded once per instance, from the follow cache when possible.
+        """
+        ids = self.__dict__.get("_followed_ids")
+        if ids is not None:
+            return ids
+
+        if self.id is None:
+            return frozenset()
+
+        shareable = not follows_changed(db.session, self, Follow)
+        ids = follow_cache.get(self.id) if shareable else None
+        if ids is None:
+            ids = frozenset(
+                followed_id
+                for followed_id, in db.session.query(Follow.followed_id).filter(
+                    Follow.follower_id == self.id
+                )
+            )
+            if shareable:
+                follow_cache.set(self.id, ids)
+
+        self._followed_ids = ids
+        return ids
+
+    def _update_followed_ids(self, user, following: bool) -> None:
+        ids = self.__dict__.get("_followed_ids")
+        if ids is not None and user.id is not None:
+            self._followed_ids = ids | {user.id} if following else ids - {user.id}
+
+    def following_many(self, ids: Iterable[int]) -> Set[int]:
+        """Those of `ids` that belong to users this user follows."""
+        followed = self.followed_ids()
+        return {id for id in ids if id in followed}
+
+    def mutual_follow_count(self, user) -> int:
+        """How many of the users this user follows also follow `user`."""
+        if self.id is None or user.id is None:
+            return 0
+
+        return get_follow_graph().mutual_count(self.id, user.id)
+
+    def suggested_users(self, limit: int) -> List[Tuple["User", int]]:
+        """Users followed by the users this user follows, with their mutual counts."""
+        if self.id is None:
+            return []
+
+        suggestions = get_follow_graph().suggestions(self.id, limit)
+        users = {
+            user.id: user
+            for user in User.query.filter(User.id.in_([id for id, _ in suggestions]))
+        }
+        return [(users[id], count) for id, count in suggestions if id in users]
 
     def is_following(self, user):
         if user.id is None:
             return False
 
-        return self.followed.filter_by(followed_id=user.id).first() is not None
+        return user.id in self.followed_ids()
 
     def is_followed_by(self, user):
         if user.id is None:
             return False
 
-        return self.followers.filter_by(follower_id=user.id).first() is not None
+        return self.id in user.followed_ids()
 
     def generate_auth_token(self, expiration: int) -> str:
         s = Serializer(current_app.config["SECRET_KEY"], expires_in=expiration)
@@ -311,12 +589,21 @@ class User(UserMixin, db.Model):
 
     @staticmethod
     def verify_auth_token(token: str) -> Any:
+        return User.load_auth_token(token)[0]
+
+    @staticmethod
+    def load_auth_token(token: str) -> Tuple[Any, Optional[int]]:
+        """Return the token's user and its expiry time, in seconds since the epoch."""
         s = Serializer(current_app.config["SECRET_KEY"])
         try:
-            data = s.loads(token)
+            data, header = s.loads(token, return_header=True)
         except:  # noqa
-            return None
-        return User.query.get(data["id"])
+            return None, None
+        return User.query.get(data["id"]), header.get("exp")
+
+    def credentials_fingerprint(self) -> Tuple[Any, ...]:
+        """The attributes whose change must invalidate cached authentication."""
+        return (self.email, self.password_hash, self.role_id, self.confirmed)
 
     def to_json(self) -> Dict[str, Any]:
         json_user = {
@@ -326,7 +613,7 @@ class User(UserMixin, db.Model):
             "last_seen": self.last_seen,
             "posts_url": url_for("api.get_user_posts", id=self.id),
             "followed_posts_url": url_for("api.get_user_followed_posts", id=self.id),
-            "post_count": self.posts.count(),
+            "post_count": self.post_count,
         }
         return json_user
 
@@ -345,35 +632,18 @@ class Post(db.Model):
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
-    author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    author_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True)
+    comment_count = db.Column(db.Integer, default=0, nullable=False)
     comments = db.relationship("Comment", backref="post", lazy="dynamic")
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = [
-            "a",
-            "abbr",
-            "acronym",
-            "b",
-            "blockquote",
-            "code",
-            "em",
-            "i",
-            "li",
-            "ol",
-            "pre",
-            "strong",
-            "ul",
-            "h1",
-            "h2",
-            "h3",
-            "p",
-        ]
-        target.body_html = bleach.linkify(
-            bleach.clean(
-                markdown(value, output_format="html"), tags=allowed_tags, strip=True
-            )
-        )
+        if value == oldvalue and target.body_html is not None:
+            return
+
+        target.body_html = post_renderer.render(value)
+        fragment_cache.invalidate("post", target.id)
 
     def to_json(self) -> Dict[str, Any]:
         json_post = {
@@ -383,7 +653,7 @@ class Post(db.Model):
             "timestamp": self.timestamp,
             "author_url": url_for("api.get_user", id=self.author_id),
             "comments_url": url_for("api.get_post_comments", id=self.id),
-            "comments_count": self.comments.count(),
+            "comments_count": self.comment_count,
         }
         return json_post
 
@@ -399,24 +669,139 @@ class Post(db.Model):
 db.event.listen(Post.body, "set", Post.on_changed_body)
 
 
+_followed_author = Follow.followed_id == Post.author_id
+_fanout_enabled = User.timeline_fanout.isnot(False)
+_fanout_disabled = User.timeline_fanout.is_(False)
+
+
+def fan_out_post(mapper, connection, target):
+    """Copy a new post into the timeline of each of its author's followers."""
+    if target.author_id is None:
+        return
+
+    follower_count = connection.execute(
+        db.select([User.follower_count]).where(User.id == target.author_id)
+    ).scalar()
+    if follower_count > current_app.config["FLASKY_TIMELINE_FANOUT_LIMIT"]:
+        # readers of popular authors fall back to the join in User.timeline
+        connection.execute(
+            User.__table__.update()
+            .where(User.id == target.author_id)
+            .values(timeline_fanout=False)
+        )
+        User.clear_popular_authors()
+        return
+
+    connection.execute(
+        TimelineEntry.__table__.insert().from_select(
+            ["user_id", "post_id", "timestamp"],
+            db.select([Follow.follower_id, Post.id, Post.timestamp])
+            .select_from(Follow.__table__.join(Post.__table__, _followed_author))
+            .where(Post.id == target.id),
+        )
+    )
+
+
+def backfill_timeline(mapper, connection, target):
+    """Copy the followed user's existing posts into the follower's timeline."""
+    already_there = db.exists().where(
+        db.and_(
+            TimelineEntry.user_id == target.follower_id,
+            TimelineEntry.post_id == Post.id,
+        )
+    )
+    connection.execute(
+        TimelineEntry.__table__.insert().from_select(
+            ["user_id", "post_id", "timestamp"],
+            db.select([db.literal(target.follower_id), Post.id, Post.timestamp])
+            .select_from(Post.__table__.join(User.__table__))
+            .where(Post.author_id == target.followed_id)
+            .where(_fanout_enabled)
+            .where(~already_there),
+        )
+    )
+
+
+def prune_timeline(mapper, connection, target):
+    """Remove the unfollowed user's posts from the follower's timeline."""
+    connection.execute(
+        TimelineEntry.__table__.delete()
+        .where(TimelineEntry.user_id == target.follower_id)
+        .where(
+            TimelineEntry.post_id.in_(
+                db.select([Post.id]).where(Post.author_id == target.followed_id)
+            )
+        )
+    )
+
+
+def _change_counter(connection, model, column, id, delta):
+    if id is None:
+        return
+
+    connection.execute(
+        model.__table__.update().where(model.id == id).values({column: column + delta})
+    )
+
+
+def count_new_post(mapper, connection, target):
+    """Keep User.post_count in step with the posts table."""
+    _change_counter(connection, User, User.post_count, target.author_id, 1)
+
+
+def count_follow(mapper, connection, target):
+    """Keep the follower and followed counters in step with the follows table."""
+    _change_counter(connection, User, User.followed_count, target.follower_id, 1)
+    _change_counter(connection, User, User.follower_count, target.followed_id, 1)
+
+
+def uncount_follow(mapper, connection, target):
+    _change_counter(connection, User, User.followed_count, target.follower_id, -1)
+    _change_counter(connection, User, User.follower_count, target.followed_id, -1)
+
+
+db.event.listen(Post, "after_insert", count_new_post)
+db.event.listen(Post, "after_insert", fan_out_post)
+db.event.listen(Follow, "after_insert", count_follow)
+db.event.listen(Follow, "after_insert", backfill_timeline)
+db.event.listen(Follow, "after_delete", uncount_follow)
+db.event.listen(Follow, "after_delete", prune_timeline)
+
+
+def forget_derived_state(target, attrs):
+    """Drop the per-instance followed ids and permissions with the loaded state."""
+    if attrs is None:
+        target.__dict__.pop("_followed_ids", None)
+    if attrs is None or "role_id" in attrs:
+        target.__dict__.pop("_permissions", None)
+
+
+def forget_permissions(target, value, oldvalue, initiator):
+    target.__dict__.pop("_permissions", None)
+
+
+db.event.listen(User, "expire", forget_derived_state)
+db.event.listen(User.role_id, "set", forget_permissions)
+
+
 class Comment(db.Model):
     __tablename__ = "comments"
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     disabled = db.Column(db.Boolean)
-    author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
-    post_id = db.Column(db.Integer, db.ForeignKey("posts.id"))
+    author_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("posts.id"), index=True)
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ["a", "abbr", "acronym", "b", "code", "em", "i", "strong"]
-        target.body_html = bleach.linkify(
-            bleach.clean(
-                markdown(value, output_format="html"), tags=allowed_tags, strip=True
-            )
-        )
+        if value == oldvalue and target.body_html is not None:
+            return
+
+        target.body_html = comment_renderer.render(value)
+        fragment_cache.invalidate("comment", target.id)
 
     def to_json(self):
         json_comment = {
@@ -441,9 +826,39 @@ class Comment(db.Model):
 db.event.listen(Comment.body, "set", Comment.on_changed_body)
 
 
+def count_new_comment(mapper, connection, target):
+    """Keep the post and author comment counters in step with the comments table."""
+    _change_counter(connection, Post, Post.comment_count, target.post_id, 1)
+    _change_counter(connection, User, User.comment_count, target.author_id, 1)
+
+
+def uncount_deleted_comment(mapper, connection, target):
+    _change_counter(connection, Post, Post.comment_count, target.post_id, -1)
+    _change_counter(connection, User, User.comment_count, target.author_id, -1)
+
+
+db.event.listen(Comment, "after_insert", count_new_comment)
+db.event.listen(Comment, "after_delete", uncount_deleted_comment)
+
+for searchable in (Post, Comment):
+    db.event.listen(searchable.__table__, "after_create", create_search_table)
+    db.event.listen(searchable.__table__, "before_drop", drop_search_table)
+    db.event.listen(searchable, "after_insert", index_body)
+    db.event.listen(searchable, "after_update", reindex_body)
+    db.event.listen(searchable, "after_delete", unindex_body)
+
+
 @login_manager.user_loader
 def load_user(user_id: str) -> User:
-    return User.query.get(int(user_id))
+    user = User.query.get(int(user_id))
+    if user is not None:
+        user.load_permissions()
+    return user
 
 
 login_manager.anonymous_user = AnonymousUser
+
+invalidate_on_commit(db, Post, Comment, User, Follow)
+invalidate_on_commit(db, Role, clear=Role.clear_cache)
+invalidate_follows_on_commit(db, Follow)
+update_graph_on_commit(db, Follow)
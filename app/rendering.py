@@ -0,0 +1,134 @@
+"""Markdown rendering for post and comment bodies.
+
+Bodies are converted to HTML, sanitised against an allowed-tag list and
+linkified. Rendered HTML is cached by a hash of the source text, and the
+Markdown, sanitiser and linkifier instances are reused (one set per thread,
+as none of them are thread-safe).
+"""
+from collections import OrderedDict
+import hashlib
+from threading import local, Lock
+from typing import Iterable, Iterator, List, Optional
+
+from bleach.linkifier import Linker
+from bleach.sanitizer import Cleaner
+from markdown import Markdown
+
+from . import db
+
+POST_TAGS = [
+    "a",
+    "abbr",
+    "acronym",
+    "b",
+    "blockquote",
+    "code",
+    "em",
+    "i",
+    "li",
+    "ol",
+    "pre",
+    "strong",
+    "ul",
+    "h1",
+    "h2",
+    "h3",
+    "p",
+]
+COMMENT_TAGS = ["a", "abbr", "acronym", "b", "code", "em", "i", "strong"]
+
+
+class MarkdownRenderer:
+    """Renders Markdown to sanitised HTML, caching the result by content hash."""
+
+    def __init__(self, tags: List[str], cache_size: int = 1024) -> None:
+        self.tags = tags
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[bytes, str]" = OrderedDict()
+        self._lock = Lock()
+        self._local = local()
+
+    def _pipeline(self):
+        if not hasattr(self._local, "markdown"):
+            self._local.markdown = Markdown(output_format="html")
+            self._local.cleaner = Cleaner(tags=self.tags, strip=True)
+            self._local.linker = Linker()
+
+        return self._local.markdown, self._local.cleaner, self._local.linker
+
+    def render_uncached(self, text: str) -> str:
+        markdown, cleaner, linker = self._pipeline()
+        html = markdown.reset().convert(text)
+        return linker.linkify(cleaner.clean(html))
+
+    def render(self, text: Optional[str]) -> Optional[str]:
+        if text is None:
+            return None
+
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        with self._lock:
+            html = self._cache.get(key)
+            if html is not None:
+                self._cache.move_to_end(key)
+                return html
+
+        html = self.render_uncached(text)
+        with self._lock:
+            self._cache[key] = html
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return html
+
+    def render_many(self, texts: Iterable[Optional[str]]) -> List[Optional[str]]:
+        """Render a batch of texts, rendering each distinct text once."""
+        rendered = {}
+        html = []
+        for text in texts:
+            if text not in rendered:
+                rendered[text] = self.render(text)
+            html.append(rendered[text])
+
+        return html
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+
+post_renderer = MarkdownRenderer(POST_TAGS)
+comment_renderer = MarkdownRenderer(COMMENT_TAGS)
+
+
+def rerender(model, renderer: MarkdownRenderer, chunk_size: int = 500) -> Iterator[int]:
+    """Re-render every body_html of `model` in chunks of `chunk_size` rows.
+
+    Yields the number of rows re-rendered after each chunk is committed.
+    """
+    renderer.clear()
+    last_id = 0
+    done = 0
+    while True:
+        rows = (
+            db.session.query(model.id, model.body)
+            .filter(model.id > last_id)
+            .order_by(model.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not rows:
+            return
+
+        html = renderer.render_many(body for _, body in rows)
+        db.session.bulk_update_mappings(
+            model,
+            [
+                {"id": id, "body_html": body_html}
+                for (id, _), body_html in zip(rows, html)
+            ],
+        )
+        db.session.commit()
+
+        last_id = rows[-1].id
+        done += len(rows)
+        yield done
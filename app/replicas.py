@@ -0,0 +1,105 @@
+"""Routing of read-only queries to read replicas.
+
+Each URI in SQLALCHEMY_REPLICA_URIS is added to SQLALCHEMY_BINDS under a
+``replica:<n>`` bind key. Only safe (GET, HEAD or OPTIONS) requests read from
+a replica: a session serving one picks a replica at random the first time it
+reads, and sends its plain SELECTs there. Everything else goes to the
+primary: every statement of an unsafe request, so that the checks a form or
+API write makes before it writes see the latest rows, statements issued
+outside a request, DML and DDL, SELECT ... FOR UPDATE, textual statements and
+bare ``session.connection()`` calls. Once a session has flushed or executed
+DML or DDL, every statement it issues goes to the primary, so it reads its
+own writes, both before and after it commits, until it is closed at the end
+of the request. The next request may see the replica's stale copy. Writes
+made through a bare connection do not pin the session.
+"""
+import random
+from typing import List, Optional
+
+from flask import has_request_context, request
+from flask_sqlalchemy import get_state, SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import DDLElement
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA = "replica:"
+# session.info key set once a session has written to the primary
+WROTE = "wrote_to_primary"
+SAFE_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+
+def replica_binds(app) -> List[str]:
+    """The bind keys of the application's read replicas."""
+    binds = app.config.get("SQLALCHEMY_BINDS") or {}
+    return sorted(key for key in binds if str(key).startswith(REPLICA))
+
+
+def is_safe_request() -> bool:
+    return has_request_context() and request.method in SAFE_METHODS
+
+
+def is_read_only(clause) -> bool:
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+
+def is_write(clause) -> bool:
+    return isinstance(clause, (UpdateBase, DDLElement))
+
+
+class RoutingSession(SignallingSession):
+    """A session that reads from a replica during safe requests, until it writes."""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if mapper is not None and mapper.persist_selectable.info.get("bind_key"):
+            return super().get_bind(mapper, clause)
+
+        if not is_safe_request():
+            return super().get_bind(mapper, clause)
+
+        replica = self._replica()
+        if replica is None or self._flushing or self.info.get(WROTE):
+            return super().get_bind(mapper, clause)
+
+        if is_write(clause):
+            self.info[WROTE] = True
+        if not is_read_only(clause):
+            return super().get_bind(mapper, clause)
+
+        return get_state(self.app).db.get_engine(self.app, bind=replica)
+
+    def _replica(self) -> Optional[str]:
+        if "replica" not in self.info:
+            binds = replica_binds(self.app)
+            self.info["replica"] = random.choice(binds) if binds else None  # noqa: S311
+        return self.info["replica"]
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def stick_to_primary(session, flush_context):
+    session.info[WROTE] = True
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy, with sessions that read from the replicas."""
+
+    def init_app(self, app) -> None:
+        uris = app.config.get("SQLALCHEMY_REPLICA_URIS") or []
+        if uris:
+            binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+            binds.update((f"{REPLICA}{i}", uri) for i, uri in enumerate(uris))
+            app.config["SQLALCHEMY_BINDS"] = binds
+
+        super().init_app(app)
+
+    def get_engines(self, app=None) -> List[Engine]:
+        """The engines of the primary and of every bind, replicas included."""
+        app = self.get_app(app)
+        binds = app.config.get("SQLALCHEMY_BINDS") or {}
+        return [self.get_engine(app)] + [
+            self.get_engine(app, bind=key) for key in sorted(binds)
+        ]
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
@@ -0,0 +1,150 @@
+"""Full-text search over post and comment bodies.
+
+On SQLite the bodies are indexed in FTS5 tables, ``posts_fts`` and
+``comments_fts``, whose rowids are the post and comment ids. They are created
+with the posts and comments tables, kept in step by the mapper listeners
+registered in app.models, and can be rebuilt with ``flask reindex``. Results
+are ranked by bm25. Other databases fall back to an unranked substring
+match.
+
+Search terms are quoted before they reach MATCH, so user input cannot use
+the FTS5 query syntax; all terms must match, the last one as a prefix.
+"""
+import re
+from typing import Any, Optional, Set, Tuple
+
+from . import db
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# (database URL, table name) of the search tables known to exist
+_search_tables: Set[Tuple[Any, str]] = set()
+
+
+def search_table_name(model) -> str:
+    return model.__tablename__ + "_fts"
+
+
+def create_search_table(table, connection, **kwargs) -> None:
+    if connection.dialect.name != "sqlite":
+        return
+
+    connection.execute(
+        db.text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {table.name}_fts "
+            "USING fts5(body, tokenize='porter unicode61')"
+        )
+    )
+    _search_tables.add((connection.engine.url, f"{table.name}_fts"))
+
+
+def drop_search_table(table, connection, **kwargs) -> None:
+    _search_tables.discard((connection.engine.url, f"{table.name}_fts"))
+    connection.execute(db.text(f"DROP TABLE IF EXISTS {table.name}_fts"))
+
+
+def _has_search_table(connection, name: str) -> bool:
+    """Whether the search table exists; only a missing one is looked up each time."""
+    if connection.dialect.name != "sqlite":
+        return False
+
+    key = (connection.engine.url, name)
+    if key in _search_tables:
+        return True
+
+    exists = (
+        connection.execute(
+            db.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": name},
+        ).first()
+        is not None
+    )
+    if exists:
+        _search_tables.add(key)
+    return exists
+
+
+def index_body(mapper, connection, target):
+    """Add a new row's body to its search table."""
+    name = search_table_name(target)
+    if _has_search_table(connection, name):
+        connection.execute(
+            db.text(f"INSERT INTO {name} (rowid, body) VALUES (:id, :body)"),
+            {"id": target.id, "body": target.body or ""},
+        )
+
+
+def reindex_body(mapper, connection, target):
+    """Replace an edited row's body in its search table."""
+    if not db.inspect(target).attrs.body.history.has_changes():
+        return
+
+    unindex_body(mapper, connection, target)
+    index_body(mapper, connection, target)
+
+
+def unindex_body(mapper, connection, target):
+    name = search_table_name(target)
+    if _has_search_table(connection, name):
+        connection.execute(
+            db.text(f"DELETE FROM {name} WHERE rowid = :id"), {"id": target.id}
+        )
+
+
+def reindex(model) -> Optional[int]:
+    """Rebuild the search table of `model` from scratch.
+
+    Returns:
+        int: The number of rows indexed, or None when the database has no
+        full-text search support.
+    """
+    connection = db.session.connection()
+    if connection.dialect.name != "sqlite":
+        return None
+
+    name = search_table_name(model)
+    drop_search_table(model.__table__, connection)
+    create_search_table(model.__table__, connection)
+    connection.execute(
+        db.text(
+            f"INSERT INTO {name} (rowid, body) "
+            f"SELECT id, coalesce(body, '') FROM {model.__tablename__}"
+        )
+    )
+    connection.execute(db.text(f"INSERT INTO {name} ({name}) VALUES ('optimize')"))
+    db.session.commit()
+    return db.session.query(model).count()
+
+
+def match_expression(q: str) -> Optional[str]:
+    """An FTS5 query matching every word of `q`, or None if it has none."""
+    words = _WORD.findall(q)
+    if not words:
+        return None
+
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+def search(model, q: str):
+    """A query for the rows of `model` whose body matches `q`, best first."""
+    expression = match_expression(q)
+    if expression is None:
+        return model.query.filter(db.false())
+
+    connection = db.session.connection()
+    name = search_table_name(model)
+    if not _has_search_table(connection, name):
+        words = _WORD.findall(q)
+        return model.query.filter(
+            *[model.body.ilike(f"%{word}%") for word in words]
+        ).order_by(model.timestamp.desc())
+
+    fts = db.table(name, db.column("rowid"), db.column("rank"))
+    matches = (
+        db.select([fts.c.rowid, fts.c.rank])
+        .where(db.literal_column(name).op("MATCH")(expression))
+        .subquery()
+    )
+    return model.query.join(matches, matches.c.rowid == model.id).order_by(
+        matches.c.rank, model.id.desc()
+    )
@@ -0,0 +1,15 @@
+"""The ASGI application script, e.g. ``uvicorn asgi:application``.
+
+With FLASKY_ASYNC_API set, the read-only API routes are served from the
+event loop by app.api.aio; otherwise every request goes to the Flask app.
+"""
+
+import os
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import create_app
+from app.api.aio import AsyncAPI
+
+app = create_app(os.environ.get("FLASK_CONFIG") or "default")
+application = AsyncAPI(app) if app.config["FLASKY_ASYNC_API"] else WsgiToAsgi(app)
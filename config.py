@@ -1,8 +1,14 @@
 import os
+import tempfile
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
+def uri_list(name):
+    """The whitespace-separated database URIs in environment variable `name`."""
+    return os.environ.get(name, "").split()
+
+
 class Configuration:
     SECRET_KEY = os.environ.get("SECRET_KEY")
 
@@ -15,11 +21,69 @@ class Configuration:
     FLASKY_MAIL_SUBJECT_PREFIX = "[Flasky]"
     FLASKY_MAIL_SENDER = "Flasky Admin <flasky@example.com>"
     FLASKY_ADMIN = os.environ.get("FLASKY_ADMIN")
+    FLASKY_MAIL_WORKERS = 2
+    FLASKY_MAIL_QUEUE_SIZE = 1000
+    FLASKY_MAIL_BATCH_SIZE = 50
+    FLASKY_MAIL_ENQUEUE_TIMEOUT = 5
+    FLASKY_MAIL_RETRIES = 3
+    FLASKY_MAIL_RETRY_BACKOFF = 1.0
+    # verified API credentials are remembered for this many seconds
+    FLASKY_AUTH_CACHE_TIMEOUT = 60
+    FLASKY_AUTH_CACHE_SIZE = 10000
     FLASKY_POSTS_PER_PAGE = 10
     FLASKY_FOLLOWERS_PER_PAGE = 10
     FLASKY_COMMENTS_PER_PAGE = 15
+    FLASKY_EXPORT_CHUNK_SIZE = 1000
+    # the most items a batch create request may hold
+    FLASKY_API_BATCH_SIZE = 500
+    # authors with more followers than this are not fanned out on write
+    FLASKY_TIMELINE_FANOUT_LIMIT = 10000
+    # the ids of those authors are cached for this many seconds
+    FLASKY_POPULAR_AUTHORS_TIMEOUT = 30
+    # each user's followed ids are cached in an LRU, expiring after the timeout
+    FLASKY_FOLLOW_CACHE_SIZE = 10000
+    FLASKY_FOLLOW_CACHE_TIMEOUT = 60
+    # the in-memory follow graph is reloaded once it is this many seconds old
+    FLASKY_FOLLOW_GRAPH_TTL = 300
+    FLASKY_FOLLOW_SUGGESTIONS = 5
+    # the cached roles table is reloaded once it is this many seconds old
+    FLASKY_ROLE_CACHE_TIMEOUT = 30
+    # last_seen is written at most once per interval, in batched updates
+    FLASKY_LAST_SEEN_INTERVAL = 60
+    FLASKY_LAST_SEEN_FLUSH_INTERVAL = 10
+    FLASKY_LAST_SEEN_BUFFER_SIZE = 500
+    # pages served to anonymous users: None, "memory" or "filesystem"
+    FLASKY_RESPONSE_CACHE = "memory"
+    FLASKY_RESPONSE_CACHE_SIZE = 500
+    FLASKY_RESPONSE_CACHE_TIMEOUT = 300
+    # posts and comments whose rendered list items are kept; 0 disables
+    FLASKY_FRAGMENT_CACHE_SIZE = 5000
+    FLASKY_RESPONSE_CACHE_DIR = os.environ.get("RESPONSE_CACHE_DIR") or os.path.join(
+        tempfile.gettempdir(), "flasky-cache"
+    )
+
+    # per-request query counts, N+1 warnings and the slow-query log
+    FLASKY_SQL_INSTRUMENTATION = False
+    FLASKY_SQL_SERVER_TIMING = True
+    FLASKY_SQL_N_PLUS_ONE_THRESHOLD = 5
+    FLASKY_SQL_LOG_PARAMETERS = False
+    FLASKY_SLOW_DB_QUERY_TIME = 0.5
+    FLASKY_SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG")
+
+    # asgi.py serves the read-only API routes from the event loop (needs
+    # asgiref and an async driver); the async engine uses the main database
+    # unless overridden
+    FLASKY_ASYNC_API = os.environ.get("FLASKY_ASYNC_API", "false").lower() in [
+        "true",
+        "on",
+        "1",
+    ]
+    FLASKY_ASYNC_DATABASE_URI = os.environ.get("ASYNC_DATABASE_URI")
+    FLASKY_ASYNC_POOL_SIZE = 10
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # read-only queries are spread over these replicas, see app.replicas
+    SQLALCHEMY_REPLICA_URIS = []
 
     @staticmethod
     def init_app(app):
@@ -28,20 +92,28 @@ class Configuration:
 
 class Development(Configuration):
     DEBUG = True
+    FLASKY_SQL_INSTRUMENTATION = True
+    FLASKY_SQL_LOG_PARAMETERS = True
     SQLALCHEMY_DATABASE_URI = os.environ.get(
         "DEV_DATABASE_URI"
     ) or "sqlite:///" + os.path.join(basedir, "data-dev.sqlite")
+    SQLALCHEMY_REPLICA_URIS = uri_list("DEV_DATABASE_REPLICA_URIS")
 
 
 class Testing(Configuration):
     TESTING = True
+    SECRET_KEY = os.environ.get("SECRET_KEY") or "testing"  # noqa: S105
+    FLASKY_MAIL_RETRY_BACKOFF = 0
     SQLALCHEMY_DATABASE_URI = os.environ.get("TEST_DATABASE_URI") or "sqlite:///"
+    SQLALCHEMY_REPLICA_URIS = uri_list("TEST_DATABASE_REPLICA_URIS")
 
 
 class Production(Configuration):
+    FLASKY_RESPONSE_CACHE = "filesystem"
     SQLALCHEMY_DATABASE_URI = os.environ.get(
         "DATABASE_URI"
     ) or "sqlite:///" + os.path.join(basedir, "data.sqlite")
+    SQLALCHEMY_REPLICA_URIS = uri_list("DATABASE_REPLICA_URIS")
 
 
 config = {
@@ -1,8 +1,9 @@
 """The application script."""
 import os
 
-from app import create_app, db
-from app.models import Comment, Follow, Permission, Post, Role, User
+from app import create_app, db, search
+from app.models import Comment, Follow, Permission, Post, Role, TimelineEntry, User
+from app.rendering import comment_renderer, post_renderer, rerender as rerender_bodies
 import click
 from flask_migrate import Migrate
 
@@ -20,6 +21,7 @@ def make_shell_context():
         Permission=Permission,
         Post=Post,
         Comment=Comment,
+        TimelineEntry=TimelineEntry,
     )
 
 
@@ -35,3 +37,151 @@ def test(test_names):
         tests = unittest.TestLoader().discover("tests")
 
     unittest.TextTestRunner(verbosity=2).run(tests)
+
+
+@app.cli.command()
+@click.argument("usernames", nargs=-1)
+def timeline(usernames):
+    """Rebuild the materialised post timelines."""
+    user_ids = None
+    if usernames:
+        users = User.query.filter(User.username.in_(usernames)).all()
+        user_ids = [user.id for user in users]
+
+    TimelineEntry.rebuild(user_ids)
+    click.echo(f"Rebuilt {TimelineEntry.query.count()} timeline entries.")
+
+
+@app.cli.command()
+def recount():
+    """Repair the denormalised post, comment and follow counters."""
+    User.recount()
+    click.echo("Recounted posts, comments and follows.")
+
+
+@app.cli.command()
+@click.option("--chunk-size", default=500, help="Rows re-rendered per commit.")
+def rerender(chunk_size):
+    """Re-render the HTML of every post and comment body."""
+    for model, renderer in ((Post, post_renderer), (Comment, comment_renderer)):
+        done = 0
+        for done in rerender_bodies(model, renderer, chunk_size):
+            click.echo(f"{model.__tablename__}: {done} re-rendered")
+
+        click.echo(f"{model.__tablename__}: done, {done} rows.")
+
+
+@app.cli.command()
+@click.option("--chunk-size", default=1000, help="Users updated per commit.")
+def avatars(chunk_size):
+    """Fill in the missing avatar hashes."""
+    done = User.backfill_avatar_hashes(chunk_size)
+    click.echo(f"Filled in {done} avatar hashes.")
+
+
+@app.cli.command()
+def reindex():
+    """Rebuild the full-text search index of posts and comments."""
+    for model in (Post, Comment):
+        count = search.reindex(model)
+        if count is None:
+            raise click.ClickException("The database has no full-text search support.")
+
+        click.echo(f"{model.__tablename__}: {count} rows indexed.")
+
+
+@app.cli.command()
+@click.option("--users", "user_count", default=1000, help="Users to create.")
+@click.option("--posts", "post_count", default=10000, help="Posts to create.")
+@click.option("--follows", default=20.0, help="Mean users followed per user.")
+@click.option("--comments", default=2.0, help="Mean comments per post.")
+@click.option(
+    "--distribution",
+    type=click.Choice(["zipf", "uniform"]),
+    default="zipf",
+    help="How popularity is spread over the users.",
+)
+@click.option("--chunk-size", default=10000, help="Rows inserted per commit.")
+@click.option("--text-pool", default=1000, help="Distinct post and comment bodies.")
+def seed(
+    user_count, post_count, follows, comments, distribution, chunk_size, text_pool
+):
+    """Bulk-load fake users, follows, posts and comments."""
+    from app import fake
+
+    def progress(stage, done, total):
+        click.echo(f"{stage}: {done}/{total}")
+
+    fake.seed(
+        user_count=user_count,
+        post_count=post_count,
+        follows_per_user=follows,
+        comments_per_post=comments,
+        distribution=distribution,
+        chunk_size=chunk_size,
+        text_pool=text_pool,
+        progress=progress,
+    )
+
+
+@app.cli.command()
+@click.option("--users", default=500, help="Users to seed.")
+@click.option("--posts", default=5000, help="Posts to seed.")
+@click.option("--repeat", default=50, help="Timed requests per endpoint.")
+@click.option("--warmup", default=5, help="Untimed requests per endpoint.")
+@click.option("--database", type=click.Path(), help="SQLite file to seed or reuse.")
+@click.option("--cache/--no-cache", default=False, help="Enable the response cache.")
+@click.option("--baseline", type=click.Path(exists=True), help="Baseline to compare.")
+@click.option("--save", type=click.Path(), help="Write the results as JSON.")
+@click.option("--tolerance", default=0.25, help="Allowed latency regression.")
+@click.option(
+    "--concurrency",
+    default=0,
+    help="Compare the sync and async API paths with this many concurrent clients.",
+)
+def bench(
+    users,
+    posts,
+    repeat,
+    warmup,
+    database,
+    cache,
+    baseline,
+    save,
+    tolerance,
+    concurrency,
+):
+    """Benchmark the hot HTML and API endpoints."""
+    import json
+
+    from app import bench as benchmarks
+
+    if concurrency:
+        results = benchmarks.run_concurrency(
+            users, posts, concurrency, repeat * concurrency, database
+        )
+        click.echo(benchmarks.format_concurrency_report(results))
+        if save:
+            with open(save, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        return
+
+    expected = None
+    if baseline:
+        with open(baseline) as f:
+            expected = json.load(f)
+
+    results = benchmarks.run(users, posts, repeat, warmup, database, cache)
+    click.echo(benchmarks.format_report(results, expected))
+
+    if save:
+        with open(save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if expected:
+        regressions = benchmarks.compare(results, expected, tolerance)
+        if regressions:
+            raise click.ClickException(
+                "Performance regressions:\n  " + "\n  ".join(regressions)
+            )
+        click.echo("No regressions against the baseline.")
@@ -0,0 +1,423 @@
+from base64 import b64encode
+from datetime import datetime, timedelta
+import asyncio
+import gzip
+import importlib.util
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app import create_app, db
+from app.aio import async_database_uri
+from app.api.serializers import comments_to_json, posts_to_json, users_to_json
+from app.models import Comment, Post, Role, User
+
+
+class APITestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_api_headers(self, username, password):
+        credentials = f"{username}:{password}".encode("utf-8")
+        return {
+            "Authorization": "Basic " + b64encode(credentials).decode("utf-8"),
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+        }
+
+    def add_user(self, email="john@example.com", password="cat"):
+        u = User(email=email, username=email.split("@")[0], password=password)
+        u.confirmed = True
+        db.session.add(u)
+        db.session.commit()
+        return u
+
+    def add_posts(self, author, count):
+        now = datetime.utcnow()
+        posts = [
+            Post(body=f"post {i}", author=author, timestamp=now + timedelta(minutes=i))
+            for i in range(count)
+        ]
+        db.session.add_all(posts)
+        db.session.commit()
+        return posts
+
+    def test_no_auth(self):
+        response = self.client.get("/api/v1/posts/")
+        self.assertEqual(response.status_code, 401)
+
+    def test_offset_pagination(self):
+        u = self.add_user()
+        self.add_posts(u, 15)
+        headers = self.get_api_headers("john@example.com", "cat")
+
+        response = self.client.get("/api/v1/posts/", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        json_response = response.get_json()
+        self.assertEqual(json_response["count"], 15)
+        self.assertEqual(len(json_response["posts"]), 10)
+        self.assertEqual(json_response["posts"][0]["body"], "post 14")
+        self.assertIsNone(json_response["prev_url"])
+        self.assertTrue(json_response["next_url"].endswith("page=2"))
+
+    def test_cursor_pagination(self):
+        u = self.add_user()
+        self.add_posts(u, 25)
+        headers = self.get_api_headers("john@example.com", "cat")
+
+        response = self.client.get("/api/v1/posts/?cursor=", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        first = response.get_json()
+        self.assertIsNone(first["count"])
+        self.assertIsNone(first["prev_url"])
+        self.assertEqual(
+            [post["body"] for post in first["posts"]],
+            [f"post {i}" for i in range(24, 14, -1)],
+        )
+
+        response = self.client.get(first["next_url"], headers=headers)
+        second = response.get_json()
+        self.assertEqual(second["posts"][0]["body"], "post 14")
+
+        response = self.client.get(second["next_url"], headers=headers)
+        third = response.get_json()
+        self.assertEqual(len(third["posts"]), 5)
+        self.assertIsNone(third["next_url"])
+
+        response = self.client.get(third["prev_url"], headers=headers)
+        self.assertEqual(response.get_json()["posts"], second["posts"])
+
+        response = self.client.get(second["prev_url"], headers=headers)
+        back = response.get_json()
+        self.assertEqual(back["posts"], first["posts"])
+        self.assertIsNone(back["prev_url"])
+
+    def test_cursor_pagination_count(self):
+        u = self.add_user()
+        self.add_posts(u, 3)
+        headers = self.get_api_headers("john@example.com", "cat")
+
+        response = self.client.get(
+            f"/api/v1/users/{u.id}/timeline/?cursor=&count=1", headers=headers
+        )
+        json_response = response.get_json()
+        self.assertEqual(json_response["count"], 3)
+        self.assertEqual(len(json_response["posts"]), 3)
+
+    def test_invalid_cursor(self):
+        self.add_user()
+        headers = self.get_api_headers("john@example.com", "cat")
+        response = self.client.get("/api/v1/comments/?cursor=nonsense", headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_conditional_get(self):
+        u = self.add_user()
+        (p,) = self.add_posts(u, 1)
+        headers = self.get_api_headers("john@example.com", "cat")
+
+        response = self.client.get(f"/api/v1/posts/{p.id}", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        last_modified = response.headers["Last-Modified"]
+
+        response = self.client.get(
+            f"/api/v1/posts/{p.id}", headers={**headers, "If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+
+        response = self.client.get(
+            f"/api/v1/posts/{p.id}",
+            headers={**headers, "If-Modified-Since": last_modified},
+        )
+        self.assertEqual(response.status_code, 304)
+
+        p.body = "edited"
+        db.session.commit()
+        response = self.client.get(
+            f"/api/v1/posts/{p.id}", headers={**headers, "If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_conditional_get_list(self):
+        u = self.add_user()
+        self.add_posts(u, 2)
+        headers = self.get_api_headers("john@example.com", "cat")
+        url = f"/api/v1/users/{u.id}/timeline/"
+
+        response = self.client.get(url, headers=headers)
+        etag = response.headers["ETag"]
+        response = self.client.get(url, headers={**headers, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        self.add_posts(u, 1)
+        response = self.client.get(url, headers={**headers, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()["posts"]), 3)
+
+    def test_cached_credentials(self):
+        u = self.add_user()
+        headers = self.get_api_headers("john@example.com", "cat")
+        with mock.patch.object(
+            User, "verify_password", autospec=True, side_effect=User.verify_password
+        ) as verify:
+            for _ in range(3):
+                response = self.client.get("/api/v1/posts/", headers=headers)
+                self.assertEqual(response.status_code, 200)
+            self.assertEqual(verify.call_count, 1)
+
+        response = self.client.post("/api/v1/tokens/", headers=headers)
+        token = response.get_json()["token"]
+        token_headers = self.get_api_headers(token, "")
+        response = self.client.get("/api/v1/posts/", headers=token_headers)
+        self.assertEqual(response.status_code, 200)
+
+        u.email = "john@example.org"
+        db.session.commit()
+        response = self.client.get("/api/v1/posts/", headers=headers)
+        self.assertEqual(response.status_code, 401)
+        headers = self.get_api_headers("john@example.org", "cat")
+        response = self.client.get("/api/v1/posts/", headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+        u.password = "dog"
+        db.session.commit()
+        response = self.client.get("/api/v1/posts/", headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+        u.confirmed = False
+        db.session.commit()
+        response = self.client.get("/api/v1/posts/", headers=token_headers)
+        self.assertEqual(response.status_code, 403)
+
+        # without a SECRET_KEY passwords are verified every time
+        u.confirmed = True
+        db.session.commit()
+        self.app.config["SECRET_KEY"] = None
+        headers = self.get_api_headers("john@example.org", "dog")
+        response = self.client.get("/api/v1/posts/", headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_serializers(self):
+        u = self.add_user()
+        posts = self.add_posts(u, 3)
+        comments = [
+            Comment(body=f"comment {i}", author=u, post=posts[0]) for i in range(2)
+        ]
+        db.session.add_all(comments)
+        db.session.commit()
+
+        with self.app.test_request_context():
+            self.assertEqual(posts_to_json(posts), [p.to_json() for p in posts])
+            self.assertEqual(
+                comments_to_json(comments), [c.to_json() for c in comments]
+            )
+            self.assertEqual(users_to_json([u]), [u.to_json()])
+
+    def test_export(self):
+        u = self.add_user()
+        self.add_posts(u, 5)
+        headers = self.get_api_headers("john@example.com", "cat")
+        response = self.client.get("/api/v1/export/posts.ndjson", headers=headers)
+        self.assertEqual(response.status_code, 403)
+
+        u.role = Role.query.filter_by(name="Administrator").first()
+        db.session.commit()
+        response = self.client.get("/api/v1/export/posts.ndjson", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(
+            [json.loads(line)["body"] for line in lines][:2], ["post 0", "post 1"]
+        )
+        self.assertEqual(len(lines), 5)
+
+        since = response.headers["X-Export-Timestamp"]
+        self.add_posts(u, 1)
+        response = self.client.get(
+            f"/api/v1/export/posts.ndjson?since={since}",
+            headers={**headers, "Accept-Encoding": "gzip"},
+        )
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        lines = gzip.decompress(response.get_data()).decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line)["body"] for line in lines], ["post 0"])
+
+        response = self.client.get(
+            "/api/v1/export/users.ndjson?since=yesterday", headers=headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_create(self):
+        u = self.add_user()
+        headers = self.get_api_headers("john@example.com", "cat")
+
+        response = self.client.post(
+            "/api/v1/posts/batch",
+            headers=headers,
+            json=[{"body": "first"}, {"body": ""}, "post", {"body": "*second*"}],
+        )
+        self.assertEqual(response.status_code, 207)
+        json_response = response.get_json()
+        self.assertEqual(json_response["created"], 2)
+        self.assertEqual(json_response["failed"], 2)
+        results = json_response["results"]
+        self.assertEqual([r["index"] for r in results], [0, 1, 2, 3])
+        self.assertEqual([r["status"] for r in results], [201, 400, 400, 201])
+        self.assertEqual(results[3]["post"]["body_html"], "<p><em>second</em></p>")
+        self.assertEqual(u.posts.count(), 2)
+        self.assertEqual(User.query.get(u.id).post_count, 2)
+
+        post = u.posts.first()
+        response = self.client.post(
+            f"/api/v1/posts/{post.id}/comments/batch",
+            headers=headers,
+            json=[{"body": "good"}, {"body": "point"}],
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()["created"], 2)
+        self.assertEqual(Post.query.get(post.id).comment_count, 2)
+
+        response = self.client.post(
+            "/api/v1/posts/batch", headers=headers, json=[{"body": ""}]
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # the created posts are reloaded in one query, not refreshed one by one
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        db.session.remove()
+        db.event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            response = self.client.post(
+                "/api/v1/posts/batch",
+                headers=headers,
+                json=[{"body": f"post {i}"} for i in range(20)],
+            )
+        finally:
+            db.event.remove(db.engine, "before_cursor_execute", record)
+        self.assertEqual(response.status_code, 201)
+        post_selects = [
+            s for s in statements if s.startswith("SELECT") and "FROM posts" in s
+        ]
+        self.assertEqual(len(post_selects), 1)
+        # the search tables are known to exist, not looked up per row
+        self.assertFalse([s for s in statements if "sqlite_master" in s])
+
+        response = self.client.post(
+            "/api/v1/posts/batch", headers=headers, json={"body": "not a list"}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["message"], "Expected a JSON array")
+
+    def test_search(self):
+        u = self.add_user()
+        self.add_posts(u, 12)
+        headers = self.get_api_headers("john@example.com", "cat")
+
+        response = self.client.get("/api/v1/search?q=post", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        json_response = response.get_json()
+        self.assertEqual(json_response["count"], 12)
+        self.assertEqual(len(json_response["posts"]), 10)
+        self.assertTrue(json_response["next"].endswith("page=2"))
+
+        response = self.client.get("/api/v1/search?q=post+11", headers=headers)
+        self.assertEqual(
+            [post["body"] for post in response.get_json()["posts"]], ["post 11"]
+        )
+
+        response = self.client.get("/api/v1/search?q=post&type=users", headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_async_database_uri(self):
+        self.assertEqual(
+            async_database_uri("sqlite:////tmp/data.sqlite"),
+            "sqlite+aiosqlite:////tmp/data.sqlite",
+        )
+        self.assertEqual(
+            async_database_uri("postgresql://u:p@db/flasky"),
+            "postgresql+asyncpg://u:p@db/flasky",
+        )
+        with self.assertRaises(ValueError):
+            async_database_uri("sqlite:///")
+
+    @unittest.skipUnless(
+        importlib.util.find_spec("asgiref") and importlib.util.find_spec("aiosqlite"),
+        "the async views need asgiref and aiosqlite",
+    )
+    def test_async_api(self):
+        from app.aio import async_db
+        from app.api.aio import AsyncAPI
+        from app.bench import asgi_get
+
+        # the async engine needs a database file it can share
+        fd, database = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        self.addCleanup(os.remove, database)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + database
+        db.session.remove()
+        db.create_all()
+        Role.insert_roles()
+        u = self.add_user()
+        posts = self.add_posts(u, 15)
+        headers = self.get_api_headers("john@example.com", "cat")
+        urls = [
+            "/api/v1/posts/",
+            "/api/v1/posts/?page=2",
+            f"/api/v1/posts/{posts[0].id}",
+            f"/api/v1/users/{u.id}",
+            "/api/v1/comments/",
+        ]
+        # the sync path verifies the credentials and caches them
+        expected = [self.client.get(url, headers=headers) for url in urls]
+        application = AsyncAPI(self.app)
+        delegated = []
+
+        async def wsgi(scope, receive, send):
+            delegated.append(scope["path"])
+            await application_wsgi(scope, receive, send)
+
+        application_wsgi, application.wsgi = application.wsgi, wsgi
+
+        async def requests():
+            try:
+                for url, sync_response in zip(urls, expected):
+                    status, body = await asgi_get(application, url, headers)
+                    self.assertEqual(status, 200, url)
+                    self.assertEqual(json.loads(body), sync_response.get_json(), url)
+                self.assertEqual(delegated, [])
+
+                status, _ = await asgi_get(application, "/api/v1/posts/12345", headers)
+                self.assertEqual(status, 404)
+
+                status, _ = await asgi_get(
+                    application, "/api/v1/posts/?cursor=", headers
+                )
+                self.assertEqual(status, 200)
+                status, _ = await asgi_get(
+                    application,
+                    "/api/v1/posts/",
+                    self.get_api_headers("john@example.com", "dog"),
+                )
+                self.assertEqual(status, 401)
+                self.assertEqual(delegated, ["/api/v1/posts/", "/api/v1/posts/"])
+            finally:
+                await async_db.engine.dispose()
+
+        asyncio.run(requests())
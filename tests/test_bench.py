@@ -0,0 +1,32 @@
+import unittest
+
+from app import bench
+
+
+class BenchTestCase(unittest.TestCase):
+    def test_measure(self):
+        results = bench.run(users=5, posts=20, repeat=3, warmup=1)
+        self.assertIn("index", results)
+        self.assertIn("api_posts", results)
+        for result in results.values():
+            self.assertLessEqual(result["p50_ms"], result["p95_ms"])
+            # every timed request issues the same queries, so the mean is exact
+            self.assertEqual(result["queries"], int(result["queries"]))
+
+    def test_compare(self):
+        baseline = {
+            "index": {"p50_ms": 10.0, "p95_ms": 20.0, "queries": 4},
+            "post": {"p50_ms": 10.0, "p95_ms": 20.0, "queries": 4},
+        }
+        results = {
+            "index": {"p50_ms": 11.0, "p95_ms": 30.0, "queries": 5},
+        }
+        self.assertEqual(
+            bench.compare(results, baseline, tolerance=0.25),
+            [
+                "index: 5 queries per request, baseline 4",
+                "index: p95_ms 30.00, baseline 20.00",
+                "post: missing from results",
+            ],
+        )
+        self.assertEqual(bench.compare(baseline, baseline, tolerance=0), [])
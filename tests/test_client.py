@@ -0,0 +1,243 @@
+import html
+import os
+import re
+import tempfile
+import unittest
+
+from app import create_app, db
+from app.cache import FileSystemBackend, response_cache
+from app.fragments import fragment_cache, FragmentStore, MAX_VARIANTS
+from app.models import Comment, Post, Role, User
+
+
+class FlaskClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_home_page(self):
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("Stranger" in response.get_data(as_text=True))
+
+    def test_anonymous_response_cache(self):
+        u = User(email="john@example.com", username="john", password="cat")
+        p = Post(body="first post", author=u)
+        db.session.add_all([u, p])
+        db.session.commit()
+
+        for url in ["/", f"/post/{p.id}", "/user/john"]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue("first post" in response.get_data(as_text=True))
+
+        p.body = "edited post"
+        response = self.client.get("/")
+        self.assertTrue("first post" in response.get_data(as_text=True))
+
+        db.session.commit()
+        response = self.client.get("/")
+        self.assertTrue("edited post" in response.get_data(as_text=True))
+
+    def test_search(self):
+        u = User(email="john@example.com", username="john", password="cat")
+        db.session.add_all([u, Post(body="searchable post", author=u)])
+        db.session.commit()
+
+        response = self.client.get("/search?q=searchable")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("searchable post" in response.get_data(as_text=True))
+
+        response = self.client.get("/search?q=searchable&type=comments")
+        self.assertFalse("searchable post" in response.get_data(as_text=True))
+
+    def count_queries(self, client, url):
+        # start each request with an empty identity map, as a real one would
+        db.session.remove()
+        queries = []
+
+        def count(*args):
+            queries.append(args[2])
+
+        engines = db.get_engines()
+        for engine in engines:
+            db.event.listen(engine, "before_cursor_execute", count)
+        try:
+            response = client.get(url)
+        finally:
+            for engine in engines:
+                db.event.remove(engine, "before_cursor_execute", count)
+
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_budget(self):
+        self.app.config["FLASKY_RESPONSE_CACHE"] = None
+        response_cache.init_app(self.app)
+        moderator = Role.query.filter_by(name="Moderator").first()
+        users = [
+            User(
+                email=f"user{i}@example.com",
+                username=f"user{i}",
+                role=moderator,
+                confirmed=True,
+            )
+            for i in range(25)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        post = Post(body="popular", author=users[0])
+        db.session.add(post)
+        for user in users:
+            db.session.add(Post(body=f"by {user.username}", author=user))
+            db.session.add(Comment(body="agreed", author=user, post=post))
+            user.follow(users[0])
+            users[0].follow(user)
+        db.session.commit()
+        post_id = post.id
+
+        moderator_client = self.app.test_client()
+        with moderator_client.session_transaction() as session:
+            session["_user_id"] = str(users[1].id)
+            session["_fresh"] = True
+        # warm the role cache and record last_seen before counting
+        moderator_client.get("/moderate")
+
+        # the most queries each page may issue, whatever its size
+        budget = {
+            "/": 3,
+            f"/post/{post_id}": 4,
+            "/followers/user0": 3,
+            "/followed_by/user0": 3,
+            "/search?q=by": 4,
+            "/search?q=agreed&type=comments": 4,
+            "/moderate": 4,
+        }
+        counts = {}
+        for per_page in (5, 20):
+            for key in ("POSTS", "COMMENTS", "FOLLOWERS"):
+                self.app.config[f"FLASKY_{key}_PER_PAGE"] = per_page
+
+            for url in budget:
+                client = moderator_client if url == "/moderate" else self.client
+                counts.setdefault(url, []).append(self.count_queries(client, url))
+
+        for url, (small, large) in counts.items():
+            self.assertEqual(small, large, url)
+            self.assertLessEqual(large, budget[url], url)
+
+    def test_followed_timeline(self):
+        self.app.config["FLASKY_POSTS_PER_PAGE"] = 2
+        john = User(email="john@example.com", username="john", confirmed=True)
+        susan = User(email="susan@example.com", username="susan", confirmed=True)
+        db.session.add_all([john, susan])
+        db.session.commit()
+        john.follow(susan)
+        for body in ("alpha", "beta", "gamma"):
+            db.session.add(Post(body=body, author=susan))
+        db.session.commit()
+
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(john.id)
+            session["_fresh"] = True
+        client.set_cookie("localhost", "show_followed", "1")
+
+        db.session.remove()
+        queries = []
+        db.event.listen(
+            db.engine, "before_cursor_execute", lambda *args: queries.append(args[2])
+        )
+        response = client.get("/")
+        data = response.get_data(as_text=True)
+        self.assertIn("gamma", data)
+        self.assertIn("beta", data)
+        self.assertNotIn("alpha", data)
+        self.assertFalse(any("count(" in query.lower() for query in queries))
+
+        next_url = re.search(r'href="(/\?cursor=[^"]+)"', data).group(1)
+        data = client.get(html.unescape(next_url)).get_data(as_text=True)
+        self.assertIn("alpha", data)
+        self.assertNotIn("beta", data)
+
+        self.assertEqual(client.get("/?cursor=nonsense").status_code, 400)
+
+    def test_fragment_cache(self):
+        self.app.config["FLASKY_RESPONSE_CACHE"] = None
+        response_cache.init_app(self.app)
+        admin = Role.query.filter_by(name="Administrator").first()
+        john = User(email="john@example.com", username="john", confirmed=True)
+        susan = User(
+            email="susan@example.com", username="susan", confirmed=True, role=admin
+        )
+        p = Post(body="first post", author=john)
+        db.session.add_all([john, susan, p])
+        db.session.commit()
+
+        response = self.client.get("/")
+        self.assertTrue("first post" in response.get_data(as_text=True))
+        self.assertEqual(len(fragment_cache.store), 1)
+
+        admin_client = self.app.test_client()
+        with admin_client.session_transaction() as session:
+            session["_user_id"] = str(susan.id)
+        for _ in range(2):
+            data = admin_client.get("/").get_data(as_text=True)
+            self.assertTrue("Edit [Admin]" in data)
+        self.assertFalse("Edit [Admin]" in self.client.get("/").get_data(as_text=True))
+
+        p.body = "edited post"
+        self.assertEqual(len(fragment_cache.store), 0)
+        db.session.commit()
+        response = self.client.get("/")
+        self.assertTrue("edited post" in response.get_data(as_text=True))
+
+    def test_fragment_store_versions(self):
+        store = FragmentStore(10)
+        store.set(("post", 1), "v1", ("admin",), "<p>admin</p>")
+        store.set(("post", 1), "v1", (None,), "<p>anonymous</p>")
+        self.assertEqual(store.get(("post", 1), "v1", ("admin",)), "<p>admin</p>")
+
+        # a new version replaces every variant of the old one
+        store.set(("post", 1), "v2", (None,), "<p>edited</p>")
+        self.assertIsNone(store.get(("post", 1), "v1", (None,)))
+        self.assertIsNone(store.get(("post", 1), "v2", ("admin",)))
+        self.assertEqual(store.get(("post", 1), "v2", (None,)), "<p>edited</p>")
+
+        for i in range(MAX_VARIANTS + 1):
+            store.set(("post", 1), "v2", (i,), "")
+        self.assertEqual(len(store), 1)
+        self.assertLessEqual(len(store._entries[("post", 1)][1]), MAX_VARIANTS)
+
+    def test_filesystem_response_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend = FileSystemBackend(directory, timeout=60, max_entries=3)
+            backend.set("/", ("index", "text/html"))
+            self.assertEqual(backend.get("/"), ("index", "text/html"))
+
+            # clearing starts a new generation; the sweep deletes the old one
+            backend.clear()
+            self.assertIsNone(backend.get("/"))
+            for i in range(5):
+                backend.set(f"/?page={i}", (str(i), "text/html"))
+            backend.sweep()
+            self.assertEqual(
+                len([name for name in os.listdir(directory) if name.endswith(".json")]),
+                3,
+            )
+
+    def test_response_cache_disabled(self):
+        self.app.config["FLASKY_RESPONSE_CACHE"] = None
+        response_cache.init_app(self.app)
+        self.assertIsNone(response_cache.backend)
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,119 @@
+from queue import Full
+import smtplib
+import unittest
+from unittest import mock
+
+from flask_mail import Connection, Message
+
+from app import create_app, db, mail
+from app.email import get_mail_queue, send_email
+from app.models import Role, User
+
+
+class EmailTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email="john@example.com", username="john", password="cat")
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def send_confirmations(self, count):
+        with self.app.test_request_context("/"):
+            for _ in range(count):
+                send_email(
+                    self.user.email,
+                    "Confirm your Account",
+                    "auth/email/confirm",
+                    user=self.user,
+                    token="token",
+                )
+
+    def test_send_email(self):
+        with mail.record_messages() as outbox:
+            self.send_confirmations(5)
+            self.assertTrue(get_mail_queue().drain(timeout=5))
+
+        self.assertEqual(len(outbox), 5)
+        self.assertEqual(outbox[0].recipients, ["john@example.com"])
+        self.assertLessEqual(len(get_mail_queue().workers), 2)
+
+    def test_retry(self):
+        connect = mail.connect
+        failures = iter([smtplib.SMTPServerDisconnected("gone")])
+
+        def flaky_connect():
+            for error in failures:
+                raise error
+            return connect()
+
+        with mock.patch.object(mail, "connect", side_effect=flaky_connect):
+            with mail.record_messages() as outbox:
+                self.send_confirmations(1)
+                self.assertTrue(get_mail_queue().drain(timeout=5))
+
+        self.assertEqual(len(outbox), 1)
+
+    def test_unexpected_error(self):
+        workers = self.app.config["FLASKY_MAIL_WORKERS"]
+        connect = mail.connect
+        failures = iter([ValueError("bad header")] * (workers + 1))
+
+        def broken_connect():
+            for error in failures:
+                raise error
+            return connect()
+
+        with mock.patch.object(mail, "connect", side_effect=broken_connect):
+            with mail.record_messages() as outbox:
+                for _ in range(workers + 1):
+                    self.send_confirmations(1)
+                    self.assertTrue(get_mail_queue().drain(timeout=5))
+                self.assertEqual(outbox, [])
+
+                # the workers survive and deliver later mail
+                self.send_confirmations(1)
+                self.assertTrue(get_mail_queue().drain(timeout=5))
+
+        self.assertEqual(len(outbox), 1)
+        self.assertTrue(all(w.is_alive() for w in get_mail_queue().workers))
+
+    def test_undeliverable_message(self):
+        send = Connection.send
+
+        def refuse_bad(connection, message, *args, **kwargs):
+            if "bad@example.com" in message.recipients:
+                raise smtplib.SMTPRecipientsRefused({"bad@example.com": (550, b"")})
+            return send(connection, message, *args, **kwargs)
+
+        queue = get_mail_queue()
+        messages = [
+            Message("Hello", sender="flasky@example.com", recipients=[to])
+            for to in ["bad@example.com", "one@example.com", "two@example.com"]
+        ]
+        with mock.patch.object(Connection, "send", refuse_bad):
+            with mail.record_messages() as outbox:
+                queue.deliver(messages)
+
+        self.assertEqual(
+            [message.recipients for message in outbox],
+            [["one@example.com"], ["two@example.com"]],
+        )
+
+    def test_full_queue_does_not_retry(self):
+        queue = get_mail_queue()
+        queue.start()
+        with mock.patch.object(
+            mail, "connect", side_effect=smtplib.SMTPServerDisconnected("gone")
+        ) as connect, mock.patch.object(queue.queue, "put", side_effect=Full):
+            self.send_confirmations(1)
+
+        self.assertEqual(connect.call_count, 1)
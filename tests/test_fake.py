@@ -0,0 +1,50 @@
+import unittest
+
+from app import create_app, db, fake
+from app.models import Comment, email_hash, Follow, Post, Role, TimelineEntry, User
+
+
+class FakeDataTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_seed(self):
+        stages = []
+        fake.seed(
+            user_count=30,
+            post_count=100,
+            follows_per_user=5,
+            comments_per_post=1,
+            chunk_size=40,
+            text_pool=10,
+            progress=lambda stage, done, total: stages.append(stage),
+        )
+        self.assertEqual(User.query.count(), 30)
+        self.assertEqual(Post.query.count(), 100)
+        self.assertEqual(len({u.username for u in User.query}), 30)
+        self.assertEqual(
+            Follow.query.filter_by(follower_id=Follow.followed_id).count(), 30
+        )
+        self.assertIn("timelines", stages)
+
+        u = User.query.first()
+        self.assertEqual(u.post_count, u.posts.count())
+        self.assertEqual(u.avatar_hash, email_hash(u.email))
+        self.assertEqual(u.follower_count, u.followers.count())
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=u.id).count(),
+            u.followed_posts.count(),
+        )
+        self.assertTrue(all(p.body_html for p in Post.query.limit(10)))
+        self.assertEqual(
+            sum(p.comment_count for p in Post.query), Comment.query.count()
+        )
@@ -0,0 +1,65 @@
+import json
+import unittest
+
+from app import create_app, db
+from app.instrumentation import logger
+from app.models import Post, Role, User
+
+
+class QueryInstrumentationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app.config["FLASKY_SQL_INSTRUMENTATION"] = True
+        self.app.config["FLASKY_RESPONSE_CACHE"] = None
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_server_timing(self):
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        timing = response.headers["Server-Timing"]
+        self.assertTrue(timing.startswith("db;dur="))
+        self.assertIn("queries", timing)
+        self.assertIn("app;dur=", timing)
+
+        self.app.config["FLASKY_SQL_SERVER_TIMING"] = False
+        response = self.client.get("/")
+        self.assertNotIn("Server-Timing", response.headers)
+
+    def test_disabled(self):
+        self.app.config["FLASKY_SQL_INSTRUMENTATION"] = False
+        response = self.client.get("/")
+        self.assertNotIn("Server-Timing", response.headers)
+
+    def test_slow_query_log(self):
+        self.app.config["FLASKY_SLOW_DB_QUERY_TIME"] = 0
+        with self.assertLogs(logger, "WARNING") as logs:
+            self.client.get("/")
+
+        events = [json.loads(record.getMessage()) for record in logs.records]
+        slow = [event for event in events if event["event"] == "slow_query"]
+        self.assertTrue(slow)
+        self.assertEqual(slow[0]["endpoint"], "main.index")
+        self.assertIn("SELECT", slow[0]["statement"])
+        self.assertNotIn("parameters", slow[0])
+
+    def test_n_plus_one(self):
+        u = User(email="john@example.com", username="john", password="cat")
+        db.session.add(u)
+        db.session.add_all([Post(body=f"post {i}", author=u) for i in range(5)])
+        db.session.commit()
+
+        self.app.config["FLASKY_SQL_N_PLUS_ONE_THRESHOLD"] = 0
+        with self.assertLogs(logger, "WARNING") as logs:
+            self.client.get("/")
+
+        events = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertTrue(any(event["event"] == "n_plus_one" for event in events))
@@ -0,0 +1,94 @@
+import unittest
+
+from app import create_app, db, search
+from app.models import Comment, Post, Role, User
+from app.rendering import MarkdownRenderer, post_renderer, rerender
+
+
+class PostModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_comment_count(self):
+        u = User(email="john@example.com", password="cat")
+        p = Post(body="post", author=u)
+        db.session.add_all([u, p])
+        db.session.commit()
+        self.assertEqual(p.comment_count, 0)
+
+        c1 = Comment(body="one", post=p, author=u)
+        c2 = Comment(body="two", post=p, author=u)
+        db.session.add_all([c1, c2])
+        db.session.commit()
+        self.assertEqual(p.comment_count, 2)
+
+        c1.disabled = True
+        db.session.commit()
+        self.assertEqual(p.comment_count, 2)
+
+        db.session.delete(c2)
+        db.session.commit()
+        self.assertEqual(p.comment_count, 1)
+        self.assertEqual(p.comment_count, p.comments.count())
+
+    def test_body_html(self):
+        p = Post(body="*hello* <script>alert(1)</script> http://example.com")
+        self.assertEqual(
+            p.body_html,
+            '<p><em>hello</em> alert(1) <a href="http://example.com" '
+            'rel="nofollow">http://example.com</a></p>',
+        )
+
+    def test_renderer_cache(self):
+        renderer = MarkdownRenderer(["em"], cache_size=2)
+        self.assertEqual(renderer.render("*a*"), "<em>a</em>")
+        self.assertEqual(
+            renderer.render_many(["*a*", "b", "*a*"]), ["<em>a</em>", "b", "<em>a</em>"]
+        )
+        renderer.render("c")
+        self.assertEqual(len(renderer._cache), 2)
+        self.assertIsNone(renderer.render(None))
+
+    def test_rerender(self):
+        p = Post(body="*post*")
+        db.session.add(p)
+        db.session.commit()
+        Post.query.update({Post.body_html: None})
+        db.session.commit()
+        self.assertEqual(list(rerender(Post, post_renderer, chunk_size=1)), [1])
+        self.assertEqual(p.body_html, "<p><em>post</em></p>")
+
+    def test_search(self):
+        u = User(email="john@example.com", password="cat")
+        p1 = Post(body="Running a *Flask* application", author=u)
+        p2 = Post(body="flask flask flask, all about flasks", author=u)
+        p3 = Post(body="Nothing to see here", author=u)
+        c = Comment(body="great flask tips", post=p3, author=u)
+        db.session.add_all([u, p1, p2, p3, c])
+        db.session.commit()
+
+        self.assertEqual(search.search(Post, "flask").all(), [p2, p1])
+        self.assertEqual(search.search(Post, "run flask").all(), [p1])
+        self.assertEqual(search.search(Post, "appl").all(), [p1])
+        self.assertEqual(search.search(Post, '"NEAR( OR').all(), [])
+        self.assertEqual(search.search(Post, "  ").all(), [])
+        self.assertEqual(search.search(Comment, "tip").all(), [c])
+
+        p3.body = "A flask of tea"
+        db.session.delete(p2)
+        db.session.commit()
+        self.assertEqual(set(search.search(Post, "flask")), {p1, p3})
+
+        db.session.execute(db.text("DELETE FROM posts_fts"))
+        self.assertEqual(search.search(Post, "flask").all(), [])
+        self.assertEqual(search.reindex(Post), 2)
+        self.assertEqual(set(search.search(Post, "flask")), {p1, p3})
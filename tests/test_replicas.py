@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app import create_app, db
+from app.cache import response_cache
+from app.models import Post, Role, User
+from app.replicas import WROTE
+from app.search import search
+from config import Testing
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        primary = "sqlite:///" + os.path.join(self.tmp.name, "primary.sqlite")
+        replica = "sqlite:///" + os.path.join(self.tmp.name, "replica.sqlite")
+        with mock.patch.object(
+            Testing, "SQLALCHEMY_DATABASE_URI", primary
+        ), mock.patch.object(Testing, "SQLALCHEMY_REPLICA_URIS", [replica]):
+            self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        # the replica has the schema, but never receives the primary's rows
+        db.metadata.create_all(db.get_engine(self.app, bind="replica:0"))
+        Role.insert_roles()
+        db.session.remove()
+        # only safe requests read from the replica
+        self.request_context = self.app.test_request_context()
+        self.request_context.push()
+
+    def tearDown(self):
+        self.request_context.pop()
+        db.session.remove()
+        db.drop_all()
+        db.get_engine(self.app, bind="replica:0").dispose()
+        self.app_context.pop()
+        self.tmp.cleanup()
+
+    def add_user(self):
+        u = User(email="john@example.com", username="john", password="cat")
+        db.session.add(u)
+        return u
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.app.config["SQLALCHEMY_BINDS"], {"replica:0": mock.ANY})
+        self.assertEqual(Role.query.count(), 0)
+        self.assertEqual(Role.query.with_for_update().count(), 3)
+
+    def test_writes_go_to_primary(self):
+        self.add_user()
+        db.session.commit()
+        db.session.remove()
+        self.assertEqual(User.query.count(), 0)
+
+        with db.engine.connect() as connection:
+            self.assertEqual(
+                connection.execute(db.text("SELECT count(*) FROM users")).scalar(), 1
+            )
+
+    def test_read_your_writes(self):
+        self.add_user()
+        db.session.flush()
+        self.assertIsNotNone(User.query.filter_by(username="john").first())
+
+        db.session.commit()
+        self.assertIsNotNone(User.query.filter_by(username="john").first())
+        self.assertEqual(Role.query.count(), 3)
+
+    def test_connection_does_not_stick(self):
+        db.session.connection()
+        db.session.execute(db.text("SELECT 1"))
+        search(Post, "anything").all()
+        self.assertFalse(db.session.info.get(WROTE))
+        self.assertEqual(Role.query.count(), 0)
+
+        db.session.execute(db.update(Role).values(default=False))
+        self.assertTrue(db.session.info[WROTE])
+        self.assertEqual(Role.query.count(), 3)
+
+    def test_unsafe_requests_read_primary(self):
+        db.session.remove()
+        with self.app.test_request_context(method="POST"):
+            self.assertEqual(Role.query.count(), 3)
+            db.session.remove()
+
+        self.request_context.pop()
+        try:
+            self.assertEqual(Role.query.count(), 3)
+            db.session.remove()
+        finally:
+            self.request_context.push()
+
+        self.assertEqual(Role.query.count(), 0)
+
+    def test_instrumentation_counts_replica_queries(self):
+        self.app.config["FLASKY_SQL_INSTRUMENTATION"] = True
+        self.app.config["FLASKY_RESPONSE_CACHE"] = None
+        response_cache.init_app(self.app)
+        response = self.app.test_client().get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('"0 queries"', response.headers["Server-Timing"])
+
+    def test_no_replicas(self):
+        app = create_app("testing")
+        with app.app_context():
+            self.assertIsNone(app.config.get("SQLALCHEMY_BINDS"))
+            self.assertIs(db.session.get_bind(User.__mapper__), db.engine)
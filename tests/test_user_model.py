@@ -1,9 +1,22 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import time
 import unittest
+from unittest import mock
 
 from app import create_app, db
-from app.models import AnonymousUser, Follow, Permission, Role, User
+from app.follow_cache import follow_cache
+from app.follow_graph import FollowGraph
+from app.last_seen import get_last_seen_buffer, LastSeenBuffer
+from app.models import (
+    AnonymousUser,
+    load_user,
+    Follow,
+    Permission,
+    Post,
+    Role,
+    TimelineEntry,
+    User,
+)
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -123,6 +136,58 @@ class UserModelTestCase(unittest.TestCase):
         self.assertTrue(u.can(Permission.MODERATE))
         self.assertFalse(u.can(Permission.ADMIN))
 
+    def test_cached_permissions(self):
+        u = User(email="john@example.com", password="cat")
+        db.session.add(u)
+        db.session.commit()
+        user_id = str(u.id)
+        db.session.expunge_all()
+
+        queries = []
+        db.event.listen(
+            db.engine, "before_cursor_execute", lambda *args: queries.append(args[2])
+        )
+        load_user(user_id)  # fills the role cache
+        db.session.expunge_all()
+        del queries[:]
+        u = load_user(user_id)
+        self.assertTrue(u.can(Permission.WRITE))
+        self.assertFalse(u.is_administrator())
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("role", u.__dict__)
+
+        u.role_id = Role.query.filter_by(name="Administrator").first().id
+        self.assertTrue(u.is_administrator())
+
+        u.role = Role.query.filter_by(name="Moderator").first()
+        self.assertTrue(u.can(Permission.MODERATE))
+        self.assertFalse(u.is_administrator())
+        db.session.commit()
+
+        moderator = Role.query.filter_by(name="Moderator").first()
+        moderator.add_permission(Permission.ADMIN)
+        db.session.commit()
+        db.session.expunge_all()
+        self.assertTrue(load_user(user_id).is_administrator())
+
+        Role.insert_roles()
+        db.session.expunge_all()
+        self.assertFalse(load_user(user_id).is_administrator())
+
+        # a change committed by another process is seen once the cache expires
+        with db.engine.begin() as connection:
+            connection.execute(
+                db.update(Role)
+                .where(Role.name == "Moderator")
+                .values(permissions=Role.permissions + Permission.ADMIN)
+            )
+        db.session.expunge_all()
+        self.assertFalse(load_user(user_id).is_administrator())
+
+        self.app.config["FLASKY_ROLE_CACHE_TIMEOUT"] = 0
+        db.session.expunge_all()
+        self.assertTrue(load_user(user_id).is_administrator())
+
     def test_admin_role(self):
         r = Role.query.filter_by(name="Administrator").first()
         u = User(email="john@example.com", password="cat", role=r)
@@ -171,6 +236,27 @@ class UserModelTestCase(unittest.TestCase):
         self.assertTrue("r=pg" in gravatar_pg)
         self.assertTrue("d=retro" in gravatar_retro)
 
+    def test_backfill_avatar_hashes(self):
+        u1 = User(email="John@example.com", password="cat")
+        u2 = User(email="susan@example.org", password="dog")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        User.query.update({User.avatar_hash: None})
+        db.session.commit()
+
+        with self.app.test_request_context("/", base_url="https://localhost"):
+            self.assertTrue(
+                u1.gravatar().startswith(
+                    "https://secure.gravatar.com/avatar/"
+                    "d4c74594d841139328695756648b6bd6"
+                )
+            )
+
+        self.assertEqual(User.backfill_avatar_hashes(chunk_size=1), 2)
+        self.assertEqual(User.backfill_avatar_hashes(), 0)
+        self.assertEqual(u1.avatar_hash, "d4c74594d841139328695756648b6bd6")
+        self.assertEqual(u2.avatar_hash, u2.gravatar_hash())
+
     def test_follows(self):
         u1 = User(email="john@example.com", password="cat")
         u2 = User(email="susan@example.org", password="dog")
@@ -208,6 +294,102 @@ class UserModelTestCase(unittest.TestCase):
         db.session.commit()
         self.assertTrue(Follow.query.count() == 1)
 
+    def test_follow_cache(self):
+        u1 = User(email="john@example.com", password="cat")
+        u2 = User(email="susan@example.org", password="dog")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertEqual(u1.followed_ids(), {u1.id})
+        self.assertEqual(follow_cache.get(u1.id), {u1.id})
+
+        u1.follow(u2)
+        self.assertTrue(u1.is_following(u2))
+        db.session.commit()
+        self.assertIsNone(follow_cache.get(u1.id))
+        self.assertEqual(u1.following_many([u2.id, u2.id + 1]), {u2.id})
+        self.assertEqual(follow_cache.get(u1.id), {u1.id, u2.id})
+        self.assertTrue(u2.is_followed_by(u1))
+
+        u1.unfollow(u2)
+        self.assertFalse(u1.is_following(u2))
+        db.session.rollback()
+        self.assertTrue(u1.is_following(u2))
+        self.assertEqual(follow_cache.get(u1.id), {u1.id, u2.id})
+
+        u1.unfollow(u2)
+        db.session.flush()
+        db.session.expire(u1)
+        self.assertFalse(u1.is_following(u2))
+        self.assertEqual(follow_cache.get(u1.id), {u1.id, u2.id})
+        db.session.commit()
+        self.assertIsNone(follow_cache.get(u1.id))
+        self.assertFalse(u1.is_following(u2))
+
+        # following ignores a stale cache entry rather than inserting twice
+        u1.follow(u2)
+        db.session.commit()
+        follow_cache.set(u1.id, frozenset({u1.id}))
+        db.session.expire(u1)
+        u1.follow(u2)
+        db.session.commit()
+        self.assertEqual(u1.followed.count(), 2)
+
+    def test_suggestions(self):
+        john, susan, david, mary = [
+            User(email=f"{name}@example.com", username=name, password="cat")
+            for name in ("john", "susan", "david", "mary")
+        ]
+        db.session.add_all([john, susan, david, mary])
+        db.session.commit()
+        john.follow(susan)
+        john.follow(david)
+        susan.follow(mary)
+        david.follow(mary)
+        susan.follow(david)
+        db.session.commit()
+
+        self.assertEqual(john.mutual_follow_count(mary), 2)
+        self.assertEqual(john.mutual_follow_count(david), 1)
+        self.assertEqual(susan.mutual_follow_count(john), 0)
+        self.assertEqual(john.suggested_users(5), [(mary, 2)])
+        self.assertEqual(mary.suggested_users(5), [])
+
+        # the loaded graph is updated by later commits
+        john.follow(mary)
+        mary.follow(susan)
+        db.session.commit()
+        self.assertEqual(john.suggested_users(5), [])
+        self.assertEqual(susan.suggested_users(5), [])
+        self.assertEqual(david.suggested_users(5), [(susan, 1)])
+
+        john.unfollow(mary)
+        db.session.commit()
+        self.assertEqual(john.suggested_users(5), [(mary, 2)])
+
+    def test_follow_graph_reload(self):
+        graph = FollowGraph()
+
+        def edges():
+            yield (1, 2)
+            # committed while the load is reading the follows table
+            graph.add(1, 3)
+            graph.remove(1, 2)
+            yield (4, 5)
+
+        graph.load(edges())
+        self.assertEqual(list(graph.followed[1]), [3])
+        self.assertEqual(list(graph.followers[5]), [4])
+
+        # while one thread reloads, the others keep the current index
+        read_edges = mock.Mock(return_value=[])
+        with graph._loading:
+            graph.refresh(0, read_edges)
+        read_edges.assert_not_called()
+        graph.refresh(0, read_edges)
+        read_edges.assert_called_once()
+        graph.refresh(60, read_edges)
+        read_edges.assert_called_once()
+
     def test_to_json(self):
         u = User(email="john@example.com", password="cat")
         db.session.add(u)
@@ -226,3 +408,108 @@ class UserModelTestCase(unittest.TestCase):
         ]
         self.assertEqual(sorted(json_user.keys()), sorted(expected_keys))
         self.assertEqual("/api/v1/users/" + str(u.id), json_user["url"])
+
+    def test_timeline(self):
+        u1 = User(email="john@example.com", password="cat")
+        u2 = User(email="susan@example.org", password="dog")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        p1 = Post(body="first", author=u2)
+        db.session.add(p1)
+        db.session.commit()
+        self.assertEqual(u1.timeline.all(), [])
+        u1.follow(u2)
+        db.session.commit()
+        self.assertEqual(u1.timeline.all(), [p1])
+        p2 = Post(body="second", author=u2)
+        db.session.add(p2)
+        db.session.commit()
+        self.assertEqual(u1.timeline.all(), [p2, p1])
+        self.assertEqual(u2.timeline.all(), [p2, p1])
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(u1.timeline.all(), [])
+        self.assertEqual(TimelineEntry.query.count(), 2)
+
+    def test_timeline_popular_author(self):
+        self.app.config["FLASKY_TIMELINE_FANOUT_LIMIT"] = 1
+        u1 = User(email="john@example.com", password="cat")
+        u2 = User(email="susan@example.org", password="dog")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        u1.follow(u2)
+        db.session.commit()
+        p = Post(body="popular", author=u2)
+        db.session.add(p)
+        db.session.commit()
+        self.assertFalse(u2.timeline_fanout)
+        self.assertEqual(TimelineEntry.query.count(), 0)
+        self.assertEqual(User.popular_author_ids(), {u2.id})
+        self.assertTrue(u1.follows_popular_author())
+        self.assertEqual(u1.timeline.all(), [p])
+
+    def test_timeline_rebuild(self):
+        u1 = User(email="john@example.com", password="cat")
+        u2 = User(email="susan@example.org", password="dog")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        u1.follow(u2)
+        db.session.add(Post(body="first", author=u2))
+        db.session.commit()
+        TimelineEntry.query.delete()
+        db.session.commit()
+        TimelineEntry.rebuild([u1.id])
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=u1.id).count(), 1)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=u2.id).count(), 0)
+        TimelineEntry.rebuild()
+        self.assertEqual(TimelineEntry.query.count(), 2)
+
+    def test_counters(self):
+        u1 = User(email="john@example.com", password="cat")
+        u2 = User(email="susan@example.org", password="dog")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertEqual(u1.follower_count, 1)
+        self.assertEqual(u1.followed_count, 1)
+        u1.follow(u2)
+        db.session.add(Post(body="post", author=u2))
+        db.session.commit()
+        self.assertEqual(u1.followed_count, 2)
+        self.assertEqual(u2.follower_count, 2)
+        self.assertEqual(u2.post_count, 1)
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(u1.followed_count, 1)
+        self.assertEqual(u2.follower_count, 1)
+
+    def test_recount(self):
+        u = User(email="john@example.com", password="cat")
+        db.session.add_all([u, Post(body="post", author=u)])
+        db.session.commit()
+        User.query.update({User.post_count: 5, User.follower_count: 0})
+        db.session.commit()
+        User.recount()
+        self.assertEqual(u.post_count, 1)
+        self.assertEqual(u.follower_count, 1)
+
+    def test_last_seen_buffer(self):
+        u = User(password="cat")
+        db.session.add(u)
+        db.session.commit()
+        buffer = LastSeenBuffer(self.app)
+        self.assertFalse(buffer.record(u))
+        u.last_seen = datetime.utcnow() - timedelta(hours=1)
+        db.session.commit()
+        last_seen_before = u.last_seen
+        self.assertTrue(buffer.record(u))
+        self.assertFalse(buffer.record(u))
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(buffer.flush(), 1)
+        db.session.expire(u)
+        self.assertTrue(u.last_seen > last_seen_before)
+        self.assertEqual(buffer.flush(), 0)
+
+        # every application buffers its own users
+        other = create_app("testing")
+        self.assertIs(get_last_seen_buffer(self.app), get_last_seen_buffer())
+        self.assertIsNot(get_last_seen_buffer(other), get_last_seen_buffer())